@@ -0,0 +1,4 @@
+"""
+__init__.py
+Benchmarks that run on generated inputs, e.g. `python -m benchmarks.history_settings --cfg cfgs/seqtrack3d_nuscenes.yaml`
+"""
@@ -0,0 +1,85 @@
+"""
+attention.py
+Fused vs materialized attention in the Seq2SeqFormer of SEQTRACK3D.
+
+python -m benchmarks.attention --cfg cfgs/seqtrack3d_nuscenes.yaml --batch_sizes 1 16 64
+
+Reports the inference latency of the transformer and, on CUDA, the peak memory of a training step
+(forward + backward) for both attention backends.
+"""
+import argparse
+
+import numpy as np
+import torch
+
+from benchmarks.common import load_config, synchronize, time_callable
+from models import get_model
+from models.attn.Modules import ScaledDotProductAttention
+
+
+def set_fused(module, fused):
+    for m in module.modules():
+        if isinstance(m, ScaledDotProductAttention):
+            m.fused = fused
+
+
+def make_transformer_inputs(config, batch_size, device, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    L = config.hist_num + 1
+    T = getattr(config, 'feature_tokens', 128)
+    trg_seq = torch.randn(batch_size, L * 8, 4, generator=g)
+    src_seq = torch.randn(batch_size, L * T, 128, generator=g)
+    valid_mask = torch.ones(batch_size, config.hist_num)
+    return trg_seq.to(device), src_seq.to(device), valid_mask.to(device)
+
+
+def train_step_peak_memory(transformer, inputs, device):
+    """
+    :return: peak memory of a forward + backward pass in MB, None when not on CUDA
+    """
+    if torch.device(device).type != 'cuda':
+        return None
+    transformer.zero_grad(set_to_none=True)
+    synchronize(device)
+    torch.cuda.reset_peak_memory_stats(device)
+    start = torch.cuda.memory_allocated(device)
+    transformer(*inputs).sum().backward()
+    synchronize(device)
+    return (torch.cuda.max_memory_allocated(device) - start) / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cfg', type=str, required=True, help='the config_file')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    config = load_config(args.cfg)
+    transformer = get_model(config.net_model)(config).Transformer.to(args.device)
+
+    rows = []
+    for batch_size in args.batch_sizes:
+        inputs = make_transformer_inputs(config, batch_size, args.device)
+        for fused in (False, True):
+            set_fused(transformer, fused)
+
+            transformer.train()
+            memory = train_step_peak_memory(transformer, inputs, args.device)
+
+            transformer.eval()
+            with torch.no_grad():
+                times = time_callable(lambda: transformer(*inputs), device=args.device, repeat=args.repeat) * 1000
+            rows.append((batch_size, 'fused' if fused else 'materialized', times.mean(),
+                         np.percentile(times, 95), memory))
+
+    print('| batch size | attention | latency mean (ms) | latency p95 (ms) | train peak memory (MB) |')
+    print('|---|---|---|---|---|')
+    for batch_size, backend, mean, p95, memory in rows:
+        memory = '-' if memory is None else f'{memory:.1f}'
+        print(f'| {batch_size} | {backend} | {mean:.2f} | {p95:.2f} | {memory} |')
+
+
+if __name__ == '__main__':
+    main()
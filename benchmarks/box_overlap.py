@@ -0,0 +1,107 @@
+"""
+box_overlap.py
+Batched box IoU / distance of utils.metrics against the per-frame shapely implementation.
+
+python -m benchmarks.box_overlap --num_boxes 1000
+
+Checks that both agree on random yaw-only box pairs (including identical, nearly touching and disjoint boxes)
+for both up axes and both IoU spaces, then times scoring tracklets of different lengths.
+Exactly touching rotated boxes are left out: shapely can return the whole box as their intersection.
+"""
+import argparse
+
+import numpy as np
+from pyquaternion import Quaternion
+
+from benchmarks.common import time_callable
+from datasets.data_classes import Box
+from utils.metrics import estimateOverlap, estimateAccuracy, estimateOverlapBatch, estimateAccuracyBatch
+from utils.waymo_metrics import estimateWaymoOverlap, estimateWaymoOverlapBatch
+
+
+def make_box_pairs(num_boxes, up_axis, seed=0):
+    rng = np.random.default_rng(seed)
+
+    def make_box(center, wlh, yaw):
+        if up_axis[1] != 0:
+            # KITTI camera frame: the box height is along y
+            return Box(center, wlh, Quaternion(axis=[0, 1, 0], radians=yaw) * Quaternion(axis=[1, 0, 0],
+                                                                                       radians=np.pi / 2))
+        return Box(center, wlh, Quaternion(axis=[0, 0, 1], radians=yaw))
+
+    boxes_a, boxes_b = [], []
+    for i in range(num_boxes):
+        center = rng.uniform(-2, 2, size=3)
+        wlh = rng.uniform(0.5, 4, size=3)
+        yaw = rng.uniform(-np.pi, np.pi)
+        kind = i % 5
+        if kind == 0:  # identical
+            other = (center, wlh, yaw)
+        elif kind == 1:  # same orientation, shifted along the heading
+            shift = np.zeros(3)
+            shift[0] = wlh[1] * rng.choice([0.5, 0.99])
+            other = (center + make_box(np.zeros(3), wlh, yaw).rotation_matrix @ shift, wlh, yaw)
+        elif kind == 2:  # far away
+            other = (center + 50, wlh, yaw)
+        else:
+            other = (center + rng.normal(scale=0.5, size=3), rng.uniform(0.5, 4, size=3), rng.uniform(-np.pi, np.pi))
+        boxes_a.append(make_box(center, wlh, yaw))
+        boxes_b.append(make_box(*other))
+    return boxes_a, boxes_b
+
+
+def check_parity(num_boxes, atol):
+    print('| up axis | IoU space | max abs IoU difference | max abs distance difference |')
+    print('|---|---|---|---|')
+    for up_axis in [(0, -1, 0), (0, 0, 1)]:
+        boxes_a, boxes_b = make_box_pairs(num_boxes, up_axis)
+        for dim in [2, 3]:
+            ious = np.array([estimateOverlap(a, b, dim=dim, up_axis=up_axis) for a, b in zip(boxes_a, boxes_b)])
+            distances = np.array([estimateAccuracy(a, b, dim=dim, up_axis=up_axis)
+                                  for a, b in zip(boxes_a, boxes_b)])
+            iou_diff = np.abs(estimateOverlapBatch(boxes_a, boxes_b, dim=dim, up_axis=up_axis) - ious).max()
+            distance_diff = np.abs(estimateAccuracyBatch(boxes_a, boxes_b, dim=dim, up_axis=up_axis)
+                                   - distances).max()
+            print(f'| {up_axis} | {dim} | {iou_diff:.2e} | {distance_diff:.2e} |')
+            assert iou_diff <= atol and distance_diff <= atol
+
+            if up_axis[2] != 0:
+                waymo_ious = np.array([estimateWaymoOverlap(a, b, dim=dim) for a, b in zip(boxes_a, boxes_b)])
+                waymo_diff = np.abs(estimateWaymoOverlapBatch(boxes_a, boxes_b, dim=dim) - waymo_ious).max()
+                print(f'| waymo | {dim} | {waymo_diff:.2e} | - |')
+                assert waymo_diff <= atol
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_boxes', type=int, default=1000)
+    parser.add_argument('--lengths', type=int, nargs='+', default=[10, 40, 200])
+    parser.add_argument('--atol', type=float, default=1e-6)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    check_parity(args.num_boxes, args.atol)
+
+    up_axis = (0, 0, 1)
+    print()
+    print('| tracklet length | per-frame shapely (ms) | batched (ms) |')
+    print('|---|---|---|')
+    for length in args.lengths:
+        boxes_a, boxes_b = make_box_pairs(length, up_axis, seed=length)
+
+        def per_frame():
+            for a, b in zip(boxes_a, boxes_b):
+                estimateOverlap(a, b, dim=3, up_axis=up_axis)
+                estimateAccuracy(a, b, dim=3, up_axis=up_axis)
+
+        def batched():
+            estimateOverlapBatch(boxes_a, boxes_b, dim=3, up_axis=up_axis)
+            estimateAccuracyBatch(boxes_a, boxes_b, dim=3, up_axis=up_axis)
+
+        legacy_ms = time_callable(per_frame, repeat=args.repeat).mean() * 1000
+        batched_ms = time_callable(batched, repeat=args.repeat).mean() * 1000
+        print(f'| {length} | {legacy_ms:.2f} | {batched_ms:.2f} |')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+common.py
+Helpers shared by the benchmark scripts
+"""
+import time
+
+import numpy as np
+import torch
+import yaml
+from easydict import EasyDict
+
+
+def load_config(file_name, **overrides):
+    with open(file_name, 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    config.update(overrides)
+    return EasyDict(config)
+
+
+def make_model_inputs(config, batch_size=1, device='cpu', seed=0):
+    """
+    Random inputs with the layout produced by MotionBaseModelMF.build_input_dict
+    """
+    rng = np.random.default_rng(seed)
+    hist_num = config.hist_num
+    num_points = (hist_num + 1) * config.point_sample_size
+    input_dict = {
+        'points': rng.uniform(-2, 2, size=(batch_size, num_points, 3 + 1 + 1)),
+        'ref_boxs': rng.normal(scale=0.1, size=(batch_size, hist_num, 4)),
+        'valid_mask': np.ones((batch_size, hist_num)),
+        'bbox_size': rng.uniform(1, 4, size=(batch_size, 3)),
+    }
+    if getattr(config, 'box_aware', False):
+        input_dict['candidate_bc'] = rng.uniform(0, 4, size=(batch_size, num_points, 9))
+    return {k: torch.tensor(v, dtype=torch.float32, device=device) for k, v in input_dict.items()}
+
+
+def synchronize(device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def time_callable(fn, device='cpu', warmup=3, repeat=20):
+    """
+    :return: np.array of the wall-clock seconds of each call
+    """
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        times.append(time.perf_counter() - start)
+    return np.array(times)
+
+
+def run_test(net, config):
+    """
+    Track the test split of the configured dataset with `net`
+    :return: dict of the metrics logged during testing, plus the tracking fps
+    """
+    import pytorch_lightning as pl
+    from torch.utils.data import DataLoader
+    from datasets import get_dataset
+
+    test_data = get_dataset(config, type='test', split=config.test_split)
+    test_loader = DataLoader(test_data, batch_size=1, num_workers=config.workers, collate_fn=lambda x: x)
+    trainer = pl.Trainer(devices=1, accelerator='auto', logger=pl.loggers.TensorBoardLogger('output/benchmarks'))
+    net.runtime.reset()
+    trainer.test(net, test_loader, verbose=False)
+    metrics = {k: float(v) for k, v in trainer.callback_metrics.items()}
+    metrics['fps'] = float(1.0 / net.runtime.compute())
+    return metrics
@@ -0,0 +1,103 @@
+"""
+ddp_eval.py
+Tests an untrained model on synthetic tracklets of uneven lengths with several CPU ranks and with one process,
+and checks that the ranks run to the end and give the metrics of the single process.
+
+python -m benchmarks.ddp_eval --ranks 2
+
+The numbers of tracklets do not divide by the number of ranks, or leave ranks without tracklets, so that
+TrackletDistributedSampler pads them with empty tracklets. As in evaluate.py, the random generators are seeded
+by tracklet, for the metrics not to depend on the rank tracking a tracklet.
+"""
+import argparse
+import json
+import random
+import subprocess
+import sys
+
+import numpy as np
+import torch
+
+from benchmarks.common import load_config
+
+
+def collate(batch):
+    return batch
+
+
+def seed_by_tracklet(net):
+    evaluate_one_sequence = net.evaluate_one_sequence
+
+    def seeded(sequence):
+        tracklet_id = sequence[0]['tracklet_id']
+        random.seed(tracklet_id)
+        np.random.seed(tracklet_id)
+        torch.manual_seed(tracklet_id)
+        return evaluate_one_sequence(sequence)
+    net.evaluate_one_sequence = seeded
+
+
+def run(cfg, devices, num_tracklets, log_dir):
+    """
+    Tests in this process, Lightning launches the other ranks. Prints the metrics from rank 0.
+    """
+    import pytorch_lightning as pl
+    from torch.utils.data import DataLoader
+    from datasets import get_dataset
+    from datasets.sampler import TrackletDistributedSampler
+    from models import get_model
+
+    config = load_config(cfg, cfg=cfg, num_test_tracklets=num_tracklets, tracklet_length=[3, 12], preloading=False,
+                         use_z=False)
+    pl.seed_everything(0)
+    net = get_model(config.net_model)(config)
+    seed_by_tracklet(net)
+    data = get_dataset(config, type='test', split=config.test_split)
+    loader = DataLoader(data, batch_size=1, collate_fn=collate, sampler=TrackletDistributedSampler(data))
+    trainer = pl.Trainer(accelerator='cpu', devices=devices, strategy='ddp' if devices > 1 else 'auto',
+                         logger=pl.loggers.TensorBoardLogger(log_dir), enable_progress_bar=False,
+                         enable_model_summary=False)
+    trainer.test(net, loader, verbose=False)
+    if trainer.is_global_zero:
+        lengths = [data.dataset.get_num_frames_tracklet(i) for i in range(len(data))]
+        metrics = {k: float(v) for k, v in trainer.callback_metrics.items() if k.endswith('/test')}
+        print('RESULT', json.dumps({'lengths': lengths, 'metrics': metrics}))
+
+
+def launch(args, devices, num_tracklets):
+    command = [sys.executable, '-m', 'benchmarks.ddp_eval', '--cfg', args.cfg, '--log_dir', args.log_dir,
+               '--run', str(devices), str(num_tracklets)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads([line for line in output.splitlines() if line.startswith('RESULT')][-1][len('RESULT'):])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cfg', type=str, default='cfgs/seqtrack3d_synthetic.yaml')
+    parser.add_argument('--ranks', type=int, default=2)
+    parser.add_argument('--tracklets', type=int, nargs='+', default=[3, 1, 5])
+    parser.add_argument('--log_dir', type=str, default='/tmp/ddp_eval')
+    parser.add_argument('--run', type=int, nargs=2, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run is not None:
+        run(args.cfg, *args.run, args.log_dir)
+        return
+
+    print(f'| tracklets | lengths | 1 process | {args.ranks} ranks | |')
+    print('|---|---|---|---|---|')
+    failed = False
+    for num_tracklets in args.tracklets:
+        single = launch(args, 1, num_tracklets)
+        ranks = launch(args, args.ranks, num_tracklets)
+        same = all(np.isclose(single['metrics'][k], ranks['metrics'][k], rtol=0, atol=1e-4)
+                   for k in single['metrics'])
+        failed |= not same
+        print(f"| {num_tracklets} | {single['lengths']} | {single['metrics']} | {ranks['metrics']} | "
+              f"{'ok' if same else 'MISMATCH'} |")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+early_exit.py
+Exit ratio, speed and accuracy of SEQTRACK3D for a range of early-exit thresholds.
+
+python -m benchmarks.early_exit --cfg cfgs/seqtrack3d_nuscenes.yaml \
+    --checkpoint pretrainedmodel/seqtrack_nuscenes_car_succ_62_prec_71.ckpt --thresholds 0.9 0.95 0.99
+
+The threshold is compared with the softmax static probability of motion_state_mlp. The first row
+(threshold '-') always runs the refinement and is the reference for the speedup and the accuracy cost.
+Pick the smallest threshold whose accuracy cost is acceptable on the validation split.
+"""
+import argparse
+import copy
+
+from benchmarks.common import load_config, run_test
+from models import get_model
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cfg', type=str, required=True, help='the config_file')
+    parser.add_argument('--checkpoint', type=str, required=True)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.8, 0.9, 0.95, 0.99])
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    base_config = load_config(args.cfg, workers=args.workers)
+
+    rows = []
+    for threshold in [None] + args.thresholds:
+        config = copy.deepcopy(base_config)
+        config.early_exit_threshold = threshold
+        net = get_model(config.net_model).load_from_checkpoint(args.checkpoint, config=config)
+        metrics = run_test(net, config)
+        rows.append((threshold, metrics.get('early_exit_ratio/test', 0.0), metrics['fps'],
+                     metrics['success/test'], metrics['precision/test']))
+
+    _, _, ref_fps, ref_success, ref_precision = rows[0]
+    print('| threshold | exit ratio | fps | speedup | success | precision | success cost | precision cost |')
+    print('|---|---|---|---|---|---|---|---|')
+    for threshold, ratio, fps, success, precision in rows:
+        threshold = '-' if threshold is None else f'{threshold:.3f}'
+        print(f'| {threshold} | {ratio:.3f} | {fps:.1f} | {fps / ref_fps:.2f}x | {success:.2f} | {precision:.2f} '
+              f'| {ref_success - success:.2f} | {ref_precision - precision:.2f} |')
+
+
+if __name__ == '__main__':
+    main()
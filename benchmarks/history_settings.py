@@ -0,0 +1,76 @@
+"""
+history_settings.py
+Latency/accuracy table of SEQTRACK3D across history lengths and point tokens per frame.
+
+python -m benchmarks.history_settings --cfg cfgs/seqtrack3d_nuscenes.yaml --settings 1:64 3:64 3:128 \
+    --checkpoints 3:128=pretrainedmodel/seqtrack_nuscenes_car_succ_62_prec_71.ckpt
+
+Latency is measured on generated inputs. Accuracy is only reported for settings with a checkpoint,
+by running the tracker on the test split of the configured dataset.
+"""
+import argparse
+import copy
+
+import numpy as np
+import torch
+
+from benchmarks.common import load_config, make_model_inputs, run_test, time_callable
+from models import get_model
+
+
+def parse_setting(setting):
+    hist_num, feature_tokens = setting.split(':')
+    return int(hist_num), int(feature_tokens)
+
+
+def evaluate_accuracy(net, config):
+    metrics = run_test(net, config)
+    return metrics['success/test'], metrics['precision/test']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cfg', type=str, required=True, help='the config_file')
+    parser.add_argument('--settings', type=str, nargs='+', default=['1:64', '1:128', '3:64', '3:128'],
+                        help='hist_num:feature_tokens pairs')
+    parser.add_argument('--checkpoints', type=str, nargs='*', default=[],
+                        help='hist_num:feature_tokens=checkpoint pairs used to report accuracy')
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    base_config = load_config(args.cfg, preloading=False, workers=args.workers)
+    checkpoints = dict(item.split('=', 1) for item in args.checkpoints)
+
+    rows = []
+    for setting in args.settings:
+        hist_num, feature_tokens = parse_setting(setting)
+        config = copy.deepcopy(base_config)
+        config.update(hist_num=hist_num, feature_tokens=feature_tokens)
+        checkpoint = checkpoints.get(setting)
+        if checkpoint is None:
+            net = get_model(config.net_model)(config)
+        else:
+            net = get_model(config.net_model).load_from_checkpoint(checkpoint, config=config)
+        net = net.to(args.device).eval()
+
+        input_dict = make_model_inputs(config, batch_size=args.batch_size, device=args.device)
+        with torch.no_grad():
+            times = time_callable(lambda: net(input_dict), device=args.device, repeat=args.repeat) * 1000
+
+        success, precision = evaluate_accuracy(net, config) if checkpoint is not None else (None, None)
+        rows.append((hist_num, feature_tokens, times.mean(), np.percentile(times, 95),
+                     success, precision))
+
+    print('| hist_num | tokens/frame | latency mean (ms) | latency p95 (ms) | success | precision |')
+    print('|---|---|---|---|---|---|')
+    for hist_num, feature_tokens, mean, p95, success, precision in rows:
+        success = '-' if success is None else f'{success:.2f}'
+        precision = '-' if precision is None else f'{precision:.2f}'
+        print(f'| {hist_num} | {feature_tokens} | {mean:.2f} | {p95:.2f} | {success} | {precision} |')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+hypotheses.py
+Cost of multi-hypothesis inference: one batched forward of M reference boxes against M sequential forwards.
+
+python -m benchmarks.hypotheses --cfg cfgs/seqtrack3d_nuscenes.yaml --num_hypotheses 1 4 8 16 \
+    --checkpoint pretrainedmodel/seqtrack_nuscenes_car_succ_62_prec_71.ckpt
+
+Latency is measured on generated inputs. With a checkpoint, the tracker is also run on the test split
+for each M to report its accuracy and fps.
+"""
+import argparse
+import copy
+
+import numpy as np
+import torch
+
+from benchmarks.common import load_config, make_model_inputs, run_test, time_callable
+from models import get_model
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cfg', type=str, required=True, help='the config_file')
+    parser.add_argument('--num_hypotheses', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--checkpoint', type=str, default=None)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    config = load_config(args.cfg, workers=args.workers)
+    net = get_model(config.net_model)(config).to(args.device).eval()
+
+    print('| M | M sequential forwards (ms) | 1 batched forward (ms) | speedup |')
+    print('|---|---|---|---|')
+    for M in args.num_hypotheses:
+        inputs = [make_model_inputs(config, batch_size=1, device=args.device, seed=i) for i in range(M)]
+        batched = {k: torch.cat([d[k] for d in inputs], dim=0) for k in inputs[0]}
+        with torch.no_grad():
+            sequential_ms = time_callable(lambda: [net(d) for d in inputs], device=args.device,
+                                          repeat=args.repeat).mean() * 1000
+            batched_ms = time_callable(lambda: net(batched), device=args.device, repeat=args.repeat).mean() * 1000
+        print(f'| {M} | {sequential_ms:.2f} | {batched_ms:.2f} | {sequential_ms / batched_ms:.2f}x |')
+
+    if args.checkpoint is None:
+        return
+    print()
+    print('| M | fps | success | precision |')
+    print('|---|---|---|---|')
+    for M in args.num_hypotheses:
+        np.random.seed(0)
+        test_config = copy.deepcopy(config)
+        test_config.num_hypotheses = M
+        test_net = get_model(config.net_model).load_from_checkpoint(args.checkpoint, config=test_config)
+        metrics = run_test(test_net, test_config)
+        print(f"| {M} | {metrics['fps']:.1f} | {metrics['success/test']:.2f} | {metrics['precision/test']:.2f} |")
+
+
+if __name__ == '__main__':
+    main()
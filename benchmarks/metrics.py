@@ -0,0 +1,68 @@
+"""
+metrics.py
+Streaming Success/Precision against the list-based TorchSuccess/TorchPrecision.
+
+python -m benchmarks.metrics --num_frames 1000000
+
+Checks that both give the same values on random tracklets (including values lying exactly on the thresholds),
+then reports the state size and the time to update and compute each metric.
+"""
+import argparse
+
+import numpy as np
+import torch
+
+from benchmarks.common import time_callable
+from utils.metrics import TorchSuccess, TorchPrecision, TorchStreamingSuccess, TorchStreamingPrecision
+
+
+def make_tracklets(num_frames, tracklet_length, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    ious = torch.rand(num_frames, generator=g)
+    distances = torch.rand(num_frames, generator=g) * 3
+    # Values on the thresholds
+    ious[::7] = torch.linspace(0, 1, 21)[torch.randint(21, (len(ious[::7]),), generator=g)]
+    distances[::7] = torch.linspace(0, 2, 21)[torch.randint(21, (len(distances[::7]),), generator=g)]
+    return ious.split(tracklet_length), distances.split(tracklet_length)
+
+
+def run(metric, tracklets):
+    metric.reset()
+    for values in tracklets:
+        metric.update(values)
+    return metric.compute()
+
+
+def state_bytes(metric):
+    size = 0
+    for name in metric._defaults:
+        state = getattr(metric, name)
+        for tensor in (state if isinstance(state, list) else [state]):
+            size += tensor.numel() * tensor.element_size()
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_frames', type=int, default=1000000)
+    parser.add_argument('--tracklet_length', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    ious, distances = make_tracklets(args.num_frames, args.tracklet_length)
+    pairs = [('success', TorchSuccess(), TorchStreamingSuccess(), ious),
+             ('precision', TorchPrecision(), TorchStreamingPrecision(), distances)]
+
+    print('| metric | implementation | value | state (bytes) | update + compute (ms) |')
+    print('|---|---|---|---|---|')
+    for name, reference, streaming, tracklets in pairs:
+        ref_value, value = float(run(reference, tracklets)), float(run(streaming, tracklets))
+        assert np.isclose(ref_value, value, rtol=0, atol=1e-4), (name, ref_value, value)
+        for implementation, metric, metric_value in [('list', reference, ref_value), ('streaming', streaming, value)]:
+            size = state_bytes(metric)
+            times = time_callable(lambda: run(metric, tracklets), warmup=1, repeat=args.repeat) * 1000
+            print(f'| {name} | {implementation} | {metric_value:.4f} | {size} | {times.mean():.1f} |')
+
+
+if __name__ == '__main__':
+    main()
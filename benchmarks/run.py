@@ -0,0 +1,326 @@
+"""
+run.py
+Microbenchmarks of the geometry, sampling, model and evaluation hot paths, on generated inputs
+(datasets.synthetic), so they need no dataset.
+
+python -m benchmarks.run --out benchmarks.json
+python -m benchmarks.run --only crop forward --out after.json --compare benchmarks.json --threshold 0.1
+
+Each benchmark records its median time per call, throughput and peak memory (cuda memory for the model
+benchmarks on cuda, python/numpy allocations otherwise). --compare reports the throughput ratio against a
+stored run, and exits with status 1 when a benchmark is slower than the baseline by more than --threshold.
+Benchmarks whose requirements are missing (e.g. the pointnet2_ops extension) are skipped.
+
+The import_* and first_batch benchmarks time a fresh interpreter (`python -X importtime -c "import datasets"`
+tells where the time goes), i.e. the startup cost of the command line scripts.
+"""
+import argparse
+import copy
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tracemalloc
+
+import numpy as np
+import torch
+
+from benchmarks.common import load_config, make_model_inputs, synchronize, time_callable
+
+BENCHMARKS = {}
+
+
+def benchmark(name, repeat=None):
+    """
+    Registers a benchmark. The decorated function takes (config, device) and returns (fn, items), the callable
+    to time and the number of items (points, samples, frames...) it processes per call.
+    :param repeat: caps the number of timed calls of slow benchmarks
+    """
+    def register(setup):
+        setup.repeat = repeat
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+_datasets = {}
+
+
+def make_dataset(config):
+    """
+    :return: 8 preloaded synthetic tracklets of 20 frames of whole scenes, shared by the benchmarks
+    """
+    from datasets.synthetic import SyntheticDataset
+    if config.cfg not in _datasets:
+        _datasets[config.cfg] = SyntheticDataset(split='train', category_name=config.category_name, num_tracklets=8,
+                                                 tracklet_length=(20, 20), preload_offset=-1,
+                                                 preloading=True, hist_num=config.hist_num)
+    return _datasets[config.cfg]
+
+
+def make_frame(config):
+    return make_dataset(config).get_frames(0, [10])[0]
+
+
+@benchmark('crop_axis_aligned')
+def crop_axis_aligned(config, device):
+    from datasets import points_utils
+    frame = make_frame(config)
+    return (lambda: points_utils.crop_pc_axis_aligned(frame['pc'], frame['3d_bbox'], offset=config.bb_offset),
+            frame['pc'].points.shape[1])
+
+
+@benchmark('subwindow')
+def subwindow(config, device):
+    from datasets import points_utils
+    frame = make_frame(config)
+    return (lambda: points_utils.generate_subwindow_with_aroundboxs(frame['pc'], frame['3d_bbox'], frame['3d_bbox'],
+                                                                    scale=config.bb_scale, offset=config.bb_offset),
+            frame['pc'].points.shape[1])
+
+
+@benchmark('transform_box_pc')
+def transform_box_pc(config, device):
+    from datasets import points_utils
+    frame = make_frame(config)
+    box = points_utils.getOffsetBB(frame['3d_bbox'], [0.2, 0.1, 0.05], degrees=False)
+
+    def fn():
+        points_utils.transform_box(frame['3d_bbox'], box)
+        points_utils.transform_pc(frame['pc'], box)
+    return fn, frame['pc'].points.shape[1]
+
+
+@benchmark('regularize_pc')
+def regularize_pc(config, device):
+    from datasets import points_utils
+    points = make_frame(config)['pc'].points.T
+    return lambda: points_utils.regularize_pc(points, config.point_sample_size), config.point_sample_size
+
+
+@benchmark('point_to_box_distance')
+def point_to_box_distance(config, device):
+    from datasets import points_utils
+    frame = make_frame(config)
+    points = np.random.default_rng(0).uniform(-3, 3, size=((config.hist_num + 1) * config.point_sample_size, 3))
+    return lambda: points_utils.get_point_to_box_distance(points, frame['3d_bbox']), len(points)
+
+
+@benchmark('motion_processing_mf')
+def motion_processing_mf(config, device):
+    from datasets.sampler import MotionTrackingSamplerMF
+    sampler = MotionTrackingSamplerMF(make_dataset(config), config=config)
+    indices = np.random.default_rng(0).integers(len(sampler), size=32)
+    return lambda: [sampler[int(i)] for i in indices], len(indices)
+
+
+def make_model(config, device):
+    from models import get_model
+    # An untrained model drifts vertically away from the points, which would leave the tracked boxes empty
+    config = copy.deepcopy(config)
+    config.use_z = False
+    return get_model(config.net_model)(config).to(device).eval()
+
+
+def forward(batch_size):
+    def setup(config, device):
+        net = make_model(config, device)
+        inputs = make_model_inputs(config, batch_size=batch_size, device=device)
+
+        def fn():
+            with torch.no_grad():
+                net(inputs)
+        return fn, batch_size
+    return setup
+
+
+for _batch_size in (1, 16, 64):
+    benchmark(f'forward_b{_batch_size}')(forward(_batch_size))
+
+
+def evaluate_one_sequence(pipeline_tracking):
+    def setup(config, device):
+        config = copy.deepcopy(config)
+        config.pipeline_tracking = pipeline_tracking
+        net = make_model(config, device)
+        sequence = make_dataset(config).get_frames(0, list(range(20)))
+
+        def fn():
+            with torch.no_grad():
+                net.evaluate_one_sequence(sequence)
+        return fn, len(sequence)
+    return setup
+
+
+benchmark('evaluate_one_sequence')(evaluate_one_sequence(False))
+benchmark('evaluate_one_sequence_pipelined')(evaluate_one_sequence(True))
+
+
+@benchmark('box_overlap')
+def box_overlap(config, device):
+    from utils.metrics import estimateOverlapBatch, estimateAccuracyBatch
+    dataset = make_dataset(config)
+    gt_boxes = [frame['3d_bbox'] for i in range(8) for frame in dataset.get_frames(i, list(range(20)))]
+    boxes = gt_boxes[1:] + gt_boxes[:1]
+
+    def fn():
+        estimateOverlapBatch(gt_boxes, boxes, dim=3, up_axis=config.up_axis)
+        estimateAccuracyBatch(gt_boxes, boxes, dim=3, up_axis=config.up_axis)
+    return fn, len(boxes)
+
+
+@benchmark('success_precision')
+def success_precision(config, device):
+    from utils.metrics import TorchStreamingSuccess, TorchStreamingPrecision
+    success, precision = TorchStreamingSuccess().to(device), TorchStreamingPrecision().to(device)
+    values = torch.rand(1000, 40, device=device)
+
+    def fn():
+        success.reset()
+        precision.reset()
+        for v in values:
+            success.update(v)
+            precision.update(3 * v)
+        success.compute()
+        precision.compute()
+    return fn, values.numel()
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def python_startup(code):
+    """
+    :return: a callable running `code` in a fresh interpreter, from the repository root
+    """
+    def fn():
+        subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+    return fn
+
+
+@benchmark('import_datasets', repeat=5)
+def import_datasets(config, device):
+    return python_startup('from datasets import get_dataset, points_utils'), 1
+
+
+@benchmark('import_model', repeat=5)
+def import_model(config, device):
+    return python_startup(f'from models import get_model; get_model({config.net_model!r})'), 1
+
+
+@benchmark('first_batch', repeat=5)
+def first_batch(config, device):
+    """
+    What main.py does before the first training step: imports, dataset and loader, first batch
+    """
+    code = '\n'.join([
+        'import pytorch_lightning, torch',
+        'from torch.utils.data import DataLoader',
+        'from benchmarks.common import load_config',
+        'from datasets import get_dataset',
+        'from models import get_model',
+        f'config = load_config({config.cfg!r}, num_tracklets=8, preloading=False)',
+        'net = get_model(config.net_model)(config)',
+        "data = get_dataset(config, type=config.train_type, split=config.train_split)",
+        'next(iter(DataLoader(data, batch_size=config.batch_size, shuffle=True)))',
+    ])
+    return python_startup(code), 1
+
+
+def peak_memory(fn, device):
+    """
+    :return: peak bytes allocated by one call
+    """
+    if torch.device(device).type == 'cuda':
+        synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+        fn()
+        synchronize(device)
+        return torch.cuda.max_memory_allocated(device) - base
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def run_benchmarks(names, config, device, repeat):
+    results = {}
+    for name in names:
+        setup = BENCHMARKS[name]
+        try:
+            fn, items = setup(config, device)
+        except ImportError as e:
+            print(f'| {name} | skipped: {e} |')
+            continue
+        if setup.repeat is None:
+            times = time_callable(fn, device=device, repeat=repeat)
+        else:
+            times = time_callable(fn, device=device, warmup=1, repeat=min(repeat, setup.repeat))
+        median = float(np.median(times))
+        results[name] = {'median_ms': median * 1000, 'throughput': items / median, 'items': items,
+                         'peak_mb': peak_memory(fn, device) / 2 ** 20}
+        r = results[name]
+        print(f"| {name} | {r['median_ms']:.3f} | {r['throughput']:.1f} | {r['peak_mb']:.1f} |")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: names of the benchmarks slower than the baseline by more than threshold
+    """
+    regressions = []
+    print('| benchmark | baseline (items/s) | current (items/s) | ratio | |')
+    print('|---|---|---|---|---|')
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        ratio = r['throughput'] / baseline[name]['throughput']
+        flag = ''
+        if ratio < 1 - threshold:
+            regressions.append(name)
+            flag = 'REGRESSION'
+        elif ratio > 1 + threshold:
+            flag = 'faster'
+        print(f"| {name} | {baseline[name]['throughput']:.1f} | {r['throughput']:.1f} | {ratio:.2f} | {flag} |")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cfg', type=str, default='cfgs/seqtrack3d_synthetic.yaml')
+    parser.add_argument('--only', type=str, nargs='+', default=None,
+                        help='run the benchmarks whose name contains one of these strings')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--out', type=str, default=None, help='json file the results are written to')
+    parser.add_argument('--compare', type=str, default=None, help='json file of a baseline run')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative throughput loss flagged')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    config = load_config(args.cfg, cfg=args.cfg)
+    names = [name for name in BENCHMARKS if args.only is None or any(s in name for s in args.only)]
+
+    print('| benchmark | median (ms) | throughput (items/s) | peak memory (MB) |')
+    print('|---|---|---|---|')
+    results = run_benchmarks(names, config, args.device, args.repeat)
+
+    if args.out is not None:
+        meta = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'device': args.device,
+                'torch': torch.__version__, 'python': platform.python_version(), 'cfg': args.cfg}
+        with open(args.out, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['results']
+        print()
+        if len(compare(results, baseline, args.threshold)) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+searchspace.py
+Vectorized search spaces of datasets.searchspace against the former per-sample implementations.
+
+python -m benchmarks.searchspace --num_samples 64 1024
+
+The former Particle/Kalman implementations are reproduced below as the reference. The former GMM needs
+pomegranate 0.14.8; when it is not installed, the GMM fit is compared with the mixture the data is drawn from.
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.common import time_callable
+from datasets.searchspace import ExhaustiveSearch, ParticleFiltering, KalmanFiltering, GaussianMixtureModel
+
+
+class LoopParticleFiltering(ParticleFiltering):
+    """One np.random.choice and multivariate_normal call per particle"""
+
+    def sample(self, n=10):
+        samples = []
+        for i in range(n):
+            if len(self.data) > 0:
+                i_mean = np.random.choice(
+                    list(range(len(self.data))),
+                    p=self.score / np.linalg.norm(self.score, ord=1))
+                sample = np.random.multivariate_normal(
+                    mean=self.data[i_mean], cov=np.diag(np.array(self.bnd)))
+            else:
+                sample = np.random.multivariate_normal(
+                    mean=np.zeros(len(self.bnd)),
+                    cov=np.diag(np.array(self.bnd) * 3))
+            samples.append(sample)
+        return np.array(samples)
+
+
+class ConcatKalmanFiltering(KalmanFiltering):
+    """Keeps every sample seen so far and recomputes the weighted moments from all of them"""
+
+    def addData(self, data, score):
+        score = score.clip(min=1e-5)
+        self.data = np.concatenate((self.data, data))
+        self.score = np.concatenate((self.score, score))
+        self.mean = np.average(self.data, weights=self.score, axis=0)
+        self.cov = np.cov(self.data.T, ddof=0, aweights=self.score)
+
+    def reset(self):
+        super().reset()
+        self.data = np.zeros((0, len(self.bnd)))
+        self.score = np.array([])
+
+
+def mixture_data(num_points, rng):
+    means = np.array([[0.0, 0.0, 0.0], [2.0, 1.0, 5.0], [-1.5, 2.0, -5.0]])
+    stds = np.array([[0.3, 0.3, 1.0], [0.5, 0.2, 2.0], [0.2, 0.6, 1.0]])
+    comp = rng.choice(len(means), size=num_points, p=[0.5, 0.3, 0.2])
+    return means[comp] + rng.standard_normal((num_points, 3)) * stds[comp]
+
+
+def gmm_log_likelihood(weights, means, covs, X):
+    diff = X[:, None] - means[None]
+    inv = np.linalg.inv(covs)
+    maha = np.einsum('nki,kij,nkj->nk', diff, inv, diff)
+    log_det = np.linalg.slogdet(covs)[1]
+    log_prob = -0.5 * (maha + log_det + X.shape[1] * np.log(2 * np.pi)) + np.log(weights)
+    return np.mean(np.logaddexp.reduce(log_prob, axis=1))
+
+
+def moments_table(rows):
+    print('| search space | implementation | n | sample (ms) | max abs mean difference | max abs std/cov difference |')
+    print('|---|---|---|---|---|---|')
+    for row in rows:
+        print('| {} | {} | {} | {:.3f} | {} | {} |'.format(*row))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_samples', type=int, nargs='+', default=[64, 1024])
+    parser.add_argument('--num_data', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+    data = mixture_data(args.num_data, rng)
+    score = rng.uniform(0, 1, size=args.num_data)
+    bnd = [1, 1, 10]
+
+    rows = []
+    exhaustive = ExhaustiveSearch()
+    times = time_callable(lambda: exhaustive.sample(), repeat=args.repeat) * 1000
+    rows.append(('exhaustive', 'grid', len(exhaustive.sample()), times.mean(), '-', '-'))
+
+    # Particle filtering: same distribution, so the moments of many samples agree
+    for n in args.num_samples:
+        reference = LoopParticleFiltering(bnd)
+        vectorized = ParticleFiltering(bnd)
+        reference.addData(data, score)
+        vectorized.addData(data, score)
+        ref_samples, samples = reference.sample(20000), vectorized.sample(20000)
+        mean_diff = np.abs(ref_samples.mean(0) - samples.mean(0)).max()
+        std_diff = np.abs(ref_samples.std(0) - samples.std(0)).max()
+        for name, space in [('loop', reference), ('vectorized', vectorized)]:
+            times = time_callable(lambda: space.sample(n), repeat=args.repeat) * 1000
+            rows.append(('particle', name, n, times.mean(), f'{mean_diff:.3f}', f'{std_diff:.3f}'))
+
+    # Kalman filtering: running sums give the same moments as recomputing them from all the samples
+    reference, vectorized = ConcatKalmanFiltering(bnd), KalmanFiltering(bnd)
+    kalman_times = []
+    for space in [reference, vectorized]:
+        def track():
+            space.reset()
+            for chunk, chunk_score in zip(np.array_split(data, 50), np.array_split(score, 50)):
+                space.addData(chunk, chunk_score)
+                space.sample(64)
+        kalman_times.append(time_callable(track, repeat=args.repeat).mean() * 1000)
+    mean_diff = np.abs(reference.mean - vectorized.mean).max()
+    cov_diff = np.abs(reference.cov - vectorized.cov).max()
+    for name, times in zip(['concat', 'running sums'], kalman_times):
+        rows.append(('kalman (50 x addData + sample)', name, 64, times, f'{mean_diff:.2e}', f'{cov_diff:.2e}'))
+    moments_table(rows)
+
+    # GMM
+    print()
+    print('| GMM | addData (ms) | sample 1024 (ms) | mean log-likelihood of the data |')
+    print('|---|---|---|---|')
+    truth = (np.array([0.5, 0.3, 0.2]), np.array([[0.0, 0.0, 0.0], [2.0, 1.0, 5.0], [-1.5, 2.0, -5.0]]),
+             np.stack([np.diag(s ** 2) for s in np.array([[0.3, 0.3, 1.0], [0.5, 0.2, 2.0], [0.2, 0.6, 1.0]])]))
+    print(f'| generating mixture | - | - | {gmm_log_likelihood(*truth, data):.3f} |')
+    gmm = GaussianMixtureModel(n_comp=3)
+    fit_ms = time_callable(lambda: gmm.addData(data, np.ones(len(data))), repeat=args.repeat).mean() * 1000
+    sample_ms = time_callable(lambda: gmm.sample(1024), repeat=args.repeat).mean() * 1000
+    print(f'| numpy EM | {fit_ms:.2f} | {sample_ms:.2f} | {gmm_log_likelihood(gmm.weights, gmm.means, gmm.covs, data):.3f} |')
+    try:
+        from pomegranate import MultivariateGaussianDistribution, GeneralMixtureModel
+    except ImportError:
+        print('| pomegranate | not installed | - | - |')
+        return
+    weights = np.ones(len(data)) / len(data)
+    fit = lambda: GeneralMixtureModel.from_samples(MultivariateGaussianDistribution, n_components=3,
+                                                   X=data, weights=weights)
+    fit_ms = time_callable(fit, repeat=args.repeat).mean() * 1000
+    model = fit()
+    sample_ms = time_callable(lambda: model.sample(int(np.round(0.8 * 1024))), repeat=args.repeat).mean() * 1000
+    print(f'| pomegranate | {fit_ms:.2f} | {sample_ms:.2f} | {np.mean(model.log_probability(data)):.3f} |')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,15 @@
-from datasets import sampler, \
-                    nuscenes_lidar_mf,  \
-                    waymo_data_mf
-                    
-
+# The dataset modules are imported by get_dataset, so that only the devkit of the dataset in use is loaded
+# (nuscenes_lidar_mf imports the nuScenes devkit, waymo_data_mf pandas)
 
 
 def get_dataset(config, type='train', **kwargs):
+    # the test samplers read each frame of a tracklet once, the frame cache only serves training
+    frame_cache_mb = getattr(config, 'frame_cache_mb', 0) if type != 'test' else 0
+    frame_read_threads = getattr(config, 'frame_read_threads', 1)
+    preload_quantize = getattr(config, 'preload_quantize', False)
+    preload_resolution = getattr(config, 'preload_resolution', 0.001)
     if config.dataset == 'nuscenes_mf':
+        from datasets import nuscenes_lidar_mf
         data = nuscenes_lidar_mf.NuScenesMFDataset(path=config.path,
                                              split=kwargs.get('split', 'train_track'),
                                              category_name=config.category_name,
@@ -17,18 +20,47 @@ def get_dataset(config, type='train', **kwargs):
                                              preload_offset=config.preload_offset if type != 'test' else -1,
                                              min_points=1 if kwargs.get('split', 'train_track') in
                                                              [config.val_split, config.test_split] else -1,
-                                            hist_num = config.hist_num)
+                                            hist_num = config.hist_num,
+                                            frame_cache_mb=frame_cache_mb,
+                                            frame_read_threads=frame_read_threads,
+                                            preload_quantize=preload_quantize,
+                                            preload_resolution=preload_resolution)
     elif config.dataset == 'waymo_mf':
+        from datasets import waymo_data_mf
         data = waymo_data_mf.WaymoDataset(path=config.path,
                                        split=kwargs.get('split', 'train'),
                                        category_name=config.category_name,
                                        preloading=config.preloading,
                                        preload_offset=config.preload_offset,
                                        tiny=config.tiny,
-                                       hist_num = config.hist_num)
+                                       hist_num = config.hist_num,
+                                       frame_cache_mb=frame_cache_mb,
+                                       frame_read_threads=frame_read_threads,
+                                       preload_quantize=preload_quantize,
+                                       preload_resolution=preload_resolution)
+    elif config.dataset == 'synthetic':
+        from datasets import synthetic
+        split = kwargs.get('split', 'train')
+        data = synthetic.SyntheticDataset(split=split,
+                                          category_name=config.category_name,
+                                          num_tracklets=config.num_tracklets if split == config.train_split
+                                          else config.num_test_tracklets,
+                                          tracklet_length=config.tracklet_length,
+                                          scene_points=config.scene_points,
+                                          object_points=config.object_points,
+                                          num_distractors=config.num_distractors,
+                                          seed=config.synthetic_seed,
+                                          preloading=config.preloading,
+                                          preload_offset=config.preload_offset,
+                                          hist_num=config.hist_num,
+                                          frame_cache_mb=frame_cache_mb,
+                                          frame_read_threads=frame_read_threads,
+                                          preload_quantize=preload_quantize,
+                                          preload_resolution=preload_resolution)
     else:
         data = None
-  
+
+    from datasets import sampler
     if type.lower() == 'train_motion_mf':
         return sampler.MotionTrackingSamplerMF(dataset=data,
                                              config=config)
@@ -2,6 +2,13 @@
 base_dataset.py
 Created by zenn at 2021/9/1 22:16
 """
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from datasets.lru_cache import ByteLRUCache
+from datasets.quantized_points import QuantizedPointCloud
 
 
 class BaseDataset:
@@ -10,7 +17,25 @@ class BaseDataset:
         self.split = split
         self.category_name = category_name
         self.preloading = kwargs.get('preloading', False)
+        # Store the preloaded points as int16 offsets from the box centre, at preload_resolution meters
+        self.preload_quantize = kwargs.get('preload_quantize', False)
+        self.preload_resolution = kwargs.get('preload_resolution', 0.001)
+        self.quantization_error = 0.
+        # Without preloading, the frames read from disk are kept in a least-recently-used cache of frame_cache_mb
+        # (per data loading worker): the samples of neighbouring frames share most of their history frames
+        self.frame_cache = None
+        if not self.preloading and kwargs.get('frame_cache_mb', 0) > 0:
+            self.frame_cache = ByteLRUCache(int(kwargs['frame_cache_mb'] * 2 ** 20))
+        # The frames of a get_frames call are read by frame_read_threads threads, file reads release the GIL.
+        # The pool is created by the process reading, e.g. each data loading worker.
+        self.frame_read_threads = kwargs.get('frame_read_threads', 1)
+        self.read_pool = None
+        self.read_pool_pid = None
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['read_pool'] = None
+        return state
 
     def get_num_tracklets(self):
         raise NotImplementedError
@@ -23,3 +48,62 @@ class BaseDataset:
 
     def get_frames(self, seq_id, frame_ids):
         raise NotImplementedError
+
+    def compress_preloaded(self, training_samples):
+        """
+        With preload_quantize, replaces the points of the preloaded frames by QuantizedPointCloud around the
+        centre of their box, and prints the memory footprint of the points and the largest quantization error
+        :return: training_samples
+        """
+        if not self.preload_quantize:
+            return training_samples
+        raw_bytes, quantized_bytes = 0, 0
+        for frames in training_samples:
+            for i, frame in enumerate(frames):
+                points = frame['pc'].points
+                pc = QuantizedPointCloud(points, frame['3d_bbox'].center, resolution=self.preload_resolution)
+                if points.shape[1] > 0:
+                    error = np.abs(pc.decode().points.astype(np.float64) - points).max()
+                    self.quantization_error = max(self.quantization_error, error)
+                raw_bytes += points.nbytes
+                quantized_bytes += pc.nbytes
+                frames[i] = dict(frame, pc=pc)
+        print(f'quantized the preloaded points: {raw_bytes / 2 ** 20:.1f} MB -> {quantized_bytes / 2 ** 20:.1f} MB, '
+              f'max error {self.quantization_error * 1000:.3f} mm')
+        return training_samples
+
+    def get_preloaded_frames(self, seq_id, frame_ids):
+        frames = [self.training_samples[seq_id][f_id] for f_id in frame_ids]
+        if self.preload_quantize:
+            frames = [dict(frame, pc=frame['pc'].decode()) for frame in frames]
+        return frames
+
+    def read_frames(self, seq_id, frame_ids, read_frame):
+        """
+        :param read_frame: frame_id -> frame read from disk, called concurrently by frame_read_threads threads
+        :return: the frames, through the frame cache
+        """
+        frames = {}
+        if self.frame_cache is not None:
+            for f_id in dict.fromkeys(frame_ids):
+                frame = self.frame_cache.get((seq_id, f_id))
+                if frame is not None:
+                    frames[f_id] = frame
+        missing = [f_id for f_id in dict.fromkeys(frame_ids) if f_id not in frames]
+        for f_id, frame in zip(missing, self.map_reads(read_frame, missing)):
+            frames[f_id] = frame
+            if self.frame_cache is not None:
+                self.frame_cache.put((seq_id, f_id), frame, frame['pc'].points.nbytes)
+        return [frames[f_id] for f_id in frame_ids]
+
+    def map_reads(self, read_frame, frame_ids):
+        """
+        :return: the frames read in the order of frame_ids
+        """
+        if self.frame_read_threads <= 1 or len(frame_ids) <= 1:
+            return [read_frame(f_id) for f_id in frame_ids]
+        if self.read_pool is None or self.read_pool_pid != os.getpid():
+            # a pool inherited by fork has no threads
+            self.read_pool = ThreadPoolExecutor(self.frame_read_threads)
+            self.read_pool_pid = os.getpid()
+        return list(self.read_pool.map(read_frame, frame_ids))
@@ -0,0 +1,88 @@
+"""
+chunk_sampler.py
+Batches of training samples shuffled by chunks of consecutive frames, so that each data loading worker reuses the
+frames of the overlapping history windows
+"""
+import numpy as np
+import torch
+
+from datasets.sampler import balance_tracklets
+from datasets.shards import distributed_rank
+
+
+class ChunkedBatchSampler(torch.utils.data.Sampler):
+    """
+    Batch sampler of a MotionTrackingSamplerMF. The frames of every tracklet are split into chunks of `chunk_frames`
+    consecutive frames, and the chunks into one stream per data loading worker of every rank, balanced by number
+    of samples. Each stream visits its chunks in a random order and shuffles the samples of `mix_chunks` chunks at
+    a time, and the batches of the streams are interleaved in the order the DataLoader hands them to its workers:
+    a worker only reads the frames of `mix_chunks` chunks at a time, which the frame cache of the dataset
+    (frame_cache_mb) keeps.
+    Every stream yields the same number of batches, so that all the ranks run the same number of steps: up to
+    a chunk and a batch of samples of each stream are dropped every epoch.
+    Call set_epoch at the start of every epoch.
+    """
+
+    def __init__(self, sampler, batch_size, num_workers=0, chunk_frames=4, mix_chunks=8, seed=0):
+        """
+        :param sampler: the MotionTrackingSamplerMF indexed by the batches
+        :param num_workers: data loading workers per rank
+        """
+        self.batch_size = batch_size
+        self.num_workers = max(num_workers, 1)
+        self.mix_chunks = mix_chunks
+        self.seed = seed
+        self.epoch = 0
+
+        # [start, end) sample indices of the chunks: the samples of a frame are consecutive, see get_anno_index
+        self.chunks = []
+        starts = sampler.tracklet_start_ids
+        for start, end in zip(starts[:-1], starts[1:]):
+            for chunk_start in range(start, end, chunk_frames):
+                self.chunks.append((chunk_start * sampler.num_candidates,
+                                    min(chunk_start + chunk_frames, end) * sampler.num_candidates))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def stream_chunks(self, num_streams):
+        """
+        :return: the chunks of each stream, balance_tracklets on their number of samples
+        """
+        return balance_tracklets([end - start for start, end in self.chunks], num_streams)
+
+    def num_batches(self, num_streams):
+        """
+        :return: number of batches of each stream
+        """
+        return min(sum(self.chunks[c][1] - self.chunks[c][0] for c in chunks)
+                   for chunks in self.stream_chunks(num_streams)) // self.batch_size
+
+    def stream(self, chunks, rng):
+        """
+        :return: the batches of a stream
+        """
+        chunks = [self.chunks[c] for c in rng.permutation(chunks)]
+        indices = []
+        for i in range(0, len(chunks), self.mix_chunks):
+            mixed = np.concatenate([np.arange(start, end) for start, end in chunks[i:i + self.mix_chunks]])
+            indices.append(rng.permutation(mixed))
+        indices = np.concatenate(indices) if len(indices) > 0 else np.zeros(0, dtype=int)
+        return [indices[i:i + self.batch_size].tolist()
+                for i in range(0, len(indices) - self.batch_size + 1, self.batch_size)]
+
+    def __iter__(self):
+        rank, world_size = distributed_rank()
+        num_streams = world_size * self.num_workers
+        num_batches = self.num_batches(num_streams)
+        rng = np.random.default_rng([self.seed, self.epoch])
+        # the rng draws the streams of all the ranks, for their chunks to be the same on every rank
+        streams = [self.stream(chunks, rng) for chunks in self.stream_chunks(num_streams)]
+        streams = streams[rank * self.num_workers:(rank + 1) * self.num_workers]
+        # the DataLoader hands batch i to worker i % num_workers
+        for i in range(num_batches):
+            for stream in streams:
+                yield stream[i]
+
+    def __len__(self):
+        return self.num_batches(distributed_rank()[1] * self.num_workers) * self.num_workers
@@ -0,0 +1,66 @@
+"""
+crop_cache.py
+Cache of the regions of interest of the training frames, reused across epochs by MotionTrackingSamplerMF
+"""
+import copy
+
+import numpy as np
+
+from datasets import points_utils
+from datasets.data_classes import PointCloud
+from datasets.lru_cache import ByteLRUCache
+
+
+class CropCache(object):
+    """
+    Keeps the points of a (tracklet, frame) point cloud around the box it is cropped with, in the canonical
+    frame of that box. The cached region contains every subwindow generate_subwindow_with_aroundboxs crops
+    around the box moved by up to `margin` meters and rotated by up to `max_angle`, so cropping the cached
+    points gives the same subwindow as cropping the whole frame.
+    """
+
+    def __init__(self, dataset, config, max_angle=np.deg2rad(10)):
+        self.dataset = dataset
+        self.scale = config.bb_scale
+        self.offset = config.bb_offset
+        self.margin = getattr(config, 'crop_cache_margin', 1.5)
+        self.max_angle = max_angle
+        self.cache = ByteLRUCache(int(getattr(config, 'crop_cache_mb', 1024) * 2 ** 20),
+                                  spill_dir=getattr(config, 'crop_cache_dir', None))
+
+    def half_extents(self, box):
+        """
+        :return: <np.float: 3>, half sizes of the cached region in the box frame
+        """
+        half_l = box.wlh[1] * self.scale / 2 + self.offset  # x
+        half_w = box.wlh[0] * self.scale / 2 + self.offset  # y
+        half_h = box.wlh[2] * self.scale / 2 + self.offset  # z
+        cos, sin = np.cos(self.max_angle), np.sin(self.max_angle)
+        return np.array([half_l * cos + half_w * sin + self.margin,
+                         half_l * sin + half_w * cos + self.margin,
+                         half_h])
+
+    def crop(self, tracklet_id, frame_id, box_frame_id):
+        frame_ids = [frame_id] if box_frame_id == frame_id else [frame_id, box_frame_id]
+        frames = self.dataset.get_frames(tracklet_id, frame_ids=frame_ids)
+        frame, crop_box = frames[0], frames[-1]['3d_bbox']
+        pc = points_utils.transform_pc(frame['pc'], crop_box)
+        mask = np.all(np.abs(pc.points[:3]) < self.half_extents(crop_box)[:, None], axis=0)
+        return pc.points[:3, mask].astype(np.float32), frame['3d_bbox'], crop_box
+
+    def get_frame(self, tracklet_id, frame_id, box_frame_id):
+        """
+        :param box_frame_id: the frame whose box the point cloud is cropped around
+        :return: {"pc": the cached points in the frame coordinates, "3d_bbox": the box of frame_id}
+        """
+        key = (tracklet_id, frame_id, box_frame_id)
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = self.crop(tracklet_id, frame_id, box_frame_id)
+            self.cache.put(key, entry, entry[0].nbytes)
+        points, box, crop_box = entry
+
+        pc = PointCloud(points.astype(np.float64))
+        pc.rotate(crop_box.rotation_matrix)
+        pc.translate(crop_box.center)
+        return {"pc": pc, "3d_bbox": copy.deepcopy(box)}
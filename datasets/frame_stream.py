@@ -0,0 +1,114 @@
+"""
+frame_stream.py
+Frames of a test tracklet read on demand by a background thread, for tracking long tracklets in bounded memory
+"""
+import queue
+import threading
+import weakref
+
+
+class FrameStream(object):
+    """
+    Sequence of the frames of a tracklet, indexable like the list returned by get_frames, for a tracker visiting
+    the frames in order: a thread reads at most `prefetch` frames ahead of the last requested one, and the frames
+    more than `history` frames behind it are released. At most history + 1 + prefetch frames are held.
+    The thread starts at the first access, in the process evaluating the tracklet. It also applies `prepare`
+    (frame -> frame) to the frames, e.g. to build their spatial index while the tracker runs the previous frame.
+    """
+
+    def __init__(self, dataset, tracklet_id, prefetch=4, history=1, prepare=None):
+        self.dataset = dataset
+        self.tracklet_id = tracklet_id
+        self.prefetch = prefetch
+        self.history = history
+        self.prepare = prepare
+        self.num_frames = dataset.get_num_frames_tracklet(tracklet_id) if dataset is not None else 0
+        self.boxes = []  # ground truth boxes of the frames read so far, kept for scoring and saving results
+        self.window = {}
+        self.queue = None
+        self.closed = threading.Event()
+
+    def __len__(self):
+        return self.num_frames
+
+    def read_frame(self, frame_id):
+        return dict(self.dataset.get_frames(self.tracklet_id, [frame_id])[0], tracklet_id=self.tracklet_id)
+
+    @staticmethod
+    def _read(stream_ref, num_frames, frames, closed):
+        """
+        Body of the reading thread. It holds the stream through a weak reference between the frames, so that a
+        stream abandoned before its last frame is collected, which closes it and ends the thread.
+        """
+        for frame_id in range(num_frames):
+            stream = stream_ref()
+            if stream is None or closed.is_set():
+                return
+            try:
+                item = stream.read_frame(frame_id)
+                if stream.prepare is not None:
+                    item = stream.prepare(item)
+            except Exception as e:  # raised by __getitem__
+                item = e
+            del stream
+            while not closed.is_set():
+                try:
+                    frames.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if closed.is_set() or isinstance(item, Exception):
+                return
+
+    def __getitem__(self, frame_id):
+        if not 0 <= frame_id < self.num_frames:
+            raise IndexError(f'frame {frame_id} of a tracklet of {self.num_frames} frames')
+        if self.queue is None:
+            self.queue = queue.Queue(maxsize=max(self.prefetch, 1))
+            weakref.finalize(self, self.closed.set)
+            threading.Thread(target=self._read, args=(weakref.ref(self), self.num_frames, self.queue, self.closed),
+                             daemon=True).start()
+        while frame_id >= len(self.boxes):
+            frame = self.queue.get()
+            if isinstance(frame, Exception):
+                self.close()
+                raise frame
+            self.window[len(self.boxes)] = frame
+            self.boxes.append(frame['3d_bbox'])
+            for old in [f for f in self.window if f < len(self.boxes) - 1 - self.history]:
+                del self.window[old]
+        if frame_id not in self.window:
+            raise IndexError(f'frame {frame_id} was released, the stream keeps {self.history} frames of history')
+        return self.window[frame_id]
+
+    def close(self):
+        """
+        Stops the reading thread and releases the frames
+        """
+        self.closed.set()
+        self.window = {}
+
+
+class PreparedFrames(FrameStream):
+    """
+    FrameStream over frames already read, e.g. the list of frames of TestTrackingSampler, to prepare them ahead
+    of the tracker
+    """
+
+    def __init__(self, frames, prefetch=2, history=1, prepare=None):
+        super().__init__(None, None, prefetch=prefetch, history=history, prepare=prepare)
+        self.frames = frames
+        self.num_frames = len(frames)
+
+    def read_frame(self, frame_id):
+        return self.frames[frame_id]
+
+
+def tracklet_boxes(sequence):
+    """
+    :param sequence: list of frames or FrameStream, after tracking
+    :return: the ground truth boxes of the frames
+    """
+    if isinstance(sequence, FrameStream):
+        return sequence.boxes
+    return [frame['3d_bbox'] for frame in sequence]
@@ -0,0 +1,74 @@
+"""
+lru_cache.py
+A least-recently-used cache bounded by the bytes of its values, which can spill evicted values to disk
+"""
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+
+class ByteLRUCache(object):
+
+    def __init__(self, max_bytes, spill_dir=None):
+        """
+        :param max_bytes: memory budget of the cached values
+        :param spill_dir: directory evicted values are pickled to, None to drop them.
+            The file names only depend on the keys, so the processes sharing a directory share their spills.
+        """
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+        self.entries = OrderedDict()  # key -> (value, nbytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def spill_path(self, key):
+        return os.path.join(self.spill_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.pkl')
+
+    def get(self, key, default=None):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+        if self.spill_dir is not None and os.path.exists(self.spill_path(key)):
+            with open(self.spill_path(key), 'rb') as f:
+                value, nbytes = pickle.load(f)
+            self.disk_hits += 1
+            self._insert(key, value, nbytes)
+            return value
+        self.misses += 1
+        return default
+
+    def put(self, key, value, nbytes):
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+        self._insert(key, value, nbytes)
+
+    def _insert(self, key, value, nbytes):
+        self.entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            self._evict()
+
+    def _evict(self):
+        key, (value, nbytes) = self.entries.popitem(last=False)
+        self.nbytes -= nbytes
+        self.evictions += 1
+        if self.spill_dir is not None and not os.path.exists(self.spill_path(key)):
+            # Write then rename, so that other processes never read a partial file
+            tmp_path = self.spill_path(key) + f'.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump((value, nbytes), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.spill_path(key))
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.nbytes, 'hits': self.hits,
+                'disk_hits': self.disk_hits, 'misses': self.misses, 'evictions': self.evictions}
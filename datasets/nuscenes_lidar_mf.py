@@ -66,7 +66,7 @@ class NuScenesMFDataset(base_dataset.BaseDataset):
         self.track_instances = self.filter_instance(split, category_name.lower(), self.min_points)
         self.tracklet_anno_list, self.tracklet_len_list = self._build_tracklet_anno()
         if self.preloading:
-            self.training_samples = self._load_data()
+            self.training_samples = self.compress_preloaded(self._load_data())
 
         # Multi-frame:
         self.hist_num = kwargs.get('hist_num', 1) # Supports numbers between 0-N
@@ -147,10 +147,10 @@ class NuScenesMFDataset(base_dataset.BaseDataset):
 
     def get_frames(self, seq_id, frame_ids):
         if self.preloading:
-            frames = [self.training_samples[seq_id][f_id] for f_id in frame_ids]
+            frames = self.get_preloaded_frames(seq_id, frame_ids)
         else:
             seq_annos = self.tracklet_anno_list[seq_id]
-            frames = [self._get_frame_from_anno_data(seq_annos[f_id]) for f_id in frame_ids]
+            frames = self.read_frames(seq_id, frame_ids, lambda f_id: self._get_frame_from_anno_data(seq_annos[f_id]))
 
         return frames
 
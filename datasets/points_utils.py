@@ -1,4 +1,3 @@
-import nuscenes.utils.geometry_utils
 import torch
 import copy
 import numpy as np
@@ -341,6 +340,31 @@ def generate_subwindow_with_aroundboxs(pc, sample_bb, ref_o, scale, offset=2, or
     return new_pc
 
 
+def build_x_index(pc):
+    """
+    :return: the order of the points of pc by x, and the points in that order, for crop_candidates
+    """
+    order = np.argsort(pc.points[0, :], kind='stable')
+    return order, pc.points[:3, order]
+
+
+def crop_candidates(pc, x_index, sample_bb, scale, offset=2):
+    """
+    The points of pc in the axis-aligned bounding box of the oriented search area of generate_subwindow(pc, sample_bb,
+    scale, offset), found with the x index of build_x_index. They are kept in their order in pc, so that cropping
+    them gives the same points, in the same order, as cropping pc.
+    """
+    order, sorted_points = x_index
+    l, w, h = sample_bb.wlh[1], sample_bb.wlh[0], sample_bb.wlh[2]
+    half = np.abs(sample_bb.rotation_matrix) @ (np.array([l, w, h]) * scale / 2 + offset) + 1e-3
+    mini, maxi = sample_bb.center - half, sample_bb.center + half
+
+    lo, hi = np.searchsorted(sorted_points[0], [mini[0], maxi[0]])
+    y, z = sorted_points[1, lo:hi], sorted_points[2, lo:hi]
+    candidates = order[lo:hi][(y > mini[1]) & (y < maxi[1]) & (z > mini[2]) & (z < maxi[2])]
+    return PointCloud(pc.points[:, np.sort(candidates)])
+
+
 def transform_box(box, ref_box, inplace=False):
     if not inplace:
         box = copy.deepcopy(box)
@@ -387,6 +411,38 @@ def get_in_box_mask(PC, box):
     return close
 
 
+def points_in_box(box, points, wlh_factor=1.0):
+    """
+    check which points are inside the oriented box, boundaries included. Same as
+    nuscenes.utils.geometry_utils.points_in_box, without importing the nuScenes devkit
+    :param box: Box
+    :param points: <np.float: 3, n>
+    :param wlh_factor: inflates or deflates the box
+    :return: <np.bool: n>
+    """
+    corners = box.corners(wlh_factor=wlh_factor)
+
+    p1 = corners[:, 0]
+    p_x = corners[:, 4]
+    p_y = corners[:, 1]
+    p_z = corners[:, 3]
+
+    i = p_x - p1
+    j = p_y - p1
+    k = p_z - p1
+
+    v = points - p1.reshape((-1, 1))
+
+    iv = np.dot(i, v)
+    jv = np.dot(j, v)
+    kv = np.dot(k, v)
+
+    mask_x = np.logical_and(0 <= iv, iv <= np.dot(i, i))
+    mask_y = np.logical_and(0 <= jv, jv <= np.dot(j, j))
+    mask_z = np.logical_and(0 <= kv, kv <= np.dot(k, k))
+    return np.logical_and(np.logical_and(mask_x, mask_y), mask_z)
+
+
 def apply_transform(in_box_pc, box, translation, rotation, flip_x, flip_y, rotation_axis=(0, 0, 1)):
     """
     Apply transformation to the box and its pc insides. pc should be inside the given box.
@@ -437,7 +493,7 @@ def apply_transform(in_box_pc, box, translation, rotation, flip_x, flip_y, rotat
 
 
 def apply_augmentation(pc, box, wlh_factor=1.25): 
-    in_box_mask = nuscenes.utils.geometry_utils.points_in_box(box, pc.points[0:3,:], wlh_factor=wlh_factor) 
+    in_box_mask = points_in_box(box, pc.points[0:3,:], wlh_factor=wlh_factor) 
 
     in_box_pc = copy.deepcopy(pc) 
     in_box_pc.points = pc.points[:, in_box_mask] 
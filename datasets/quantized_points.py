@@ -0,0 +1,32 @@
+"""
+quantized_points.py
+Point clouds stored as int16 offsets from a centre, for a compact preloaded dataset
+"""
+import numpy as np
+
+from datasets.data_classes import PointCloud
+
+INT16_MAX = np.iinfo(np.int16).max
+
+
+class QuantizedPointCloud(object):
+    """
+    Points <3, N> stored as int16 multiples of a per-axis step from `center`. The step is `resolution`, or larger
+    on the axes where the points extend further than 32767 steps from the centre, so that all the points are kept.
+    The error of a coordinate is at most half a step, plus the rounding to the dtype of the points.
+    """
+
+    def __init__(self, points, center, resolution=0.001):
+        self.dtype = points.dtype
+        self.center = np.asarray(center, dtype=np.float64).reshape(3, 1)
+        offsets = points[:3].astype(np.float64) - self.center
+        extent = np.abs(offsets).max(axis=1, keepdims=True) if offsets.shape[1] > 0 else np.zeros((3, 1))
+        self.step = np.maximum(resolution, extent / INT16_MAX)
+        self.values = np.clip(np.round(offsets / self.step), -INT16_MAX, INT16_MAX).astype(np.int16)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.center.nbytes + self.step.nbytes
+
+    def decode(self):
+        return PointCloud((self.values * self.step + self.center).astype(self.dtype))
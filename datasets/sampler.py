@@ -1,18 +1,31 @@
 # Created by zenn at 2021/4/27
 # Modified by Aron Lin at Jun 4 20:32:36 CST 2023 
 
+import heapq
+
 import numpy as np
 import torch
 from easydict import EasyDict
-from nuscenes.utils import geometry_utils
+from torch.utils.data.distributed import DistributedSampler
 
 import datasets.points_utils as points_utils
+from datasets.searchspace import KalmanFiltering
+from datasets.crop_cache import CropCache
+from datasets.frame_stream import FrameStream
+from datasets.shards import distributed_rank
+from utils.timing import StageTimer, NULL_TIMER
 
 from datasets.misc_utils import get_history_frame_ids_and_masks, \
     create_history_frame_dict, \
     generate_timestamp_prev_list, \
     generate_virtual_points
 
+# Stages of MotionTrackingSamplerMF timed with profile_data_pipeline, 'rejected' is the time of the attempts
+# failing an assertion. The 'data_stats' of a sample holds the nanoseconds spent in each stage, followed by
+# the number of rejected attempts and the FRAME_CACHE_COUNTERS of the frame cache of the dataset (frame_cache_mb)
+# while reading the sample.
+DATA_STAGES = ('read', 'empty_check', 'crop', 'boxes', 'resample', 'labels', 'box_cloud', 'rejected')
+FRAME_CACHE_COUNTERS = ('hits', 'misses', 'evictions')
 
 def no_processing(data, *args):
     return data
@@ -55,9 +68,8 @@ def siamese_processing(data, config, template_transform=None, search_transform=N
     if candidate_id == 0 and config.num_candidates > 1:
         sample_offset = np.zeros(3)
     else:
-        # gaussian = KalmanFiltering(bnd=[1, 1, (5 if config.degrees else np.deg2rad(5))])
-        # sample_offset = gaussian.sample(1)[0]
-        raise NotImplementedError("Previously used pomegranate's KalmanFiltering here, now disabled. Update required.")
+        gaussian = KalmanFiltering(bnd=[1, 1, (5 if config.degrees else np.deg2rad(5))])
+        sample_offset = gaussian.sample(1)[0]
     sample_bb = points_utils.getOffsetBB(search_box, sample_offset, limit_box=config.data_limit_box,
                                          degrees=config.degrees)
     search_pc_crop = points_utils.generate_subwindow(search_pc, sample_bb,
@@ -101,7 +113,7 @@ def motion_processing(data, config, template_transform=None, search_transform=No
     prev_pc, prev_box = prev_frame['pc'], prev_frame['3d_bbox']
     this_pc, this_box = this_frame['pc'], this_frame['3d_bbox']
 
-    num_points_in_prev_box = geometry_utils.points_in_box(prev_box, prev_pc.points[0:3,:]).sum() 
+    num_points_in_prev_box = points_utils.points_in_box(prev_box, prev_pc.points[0:3,:]).sum() 
     assert num_points_in_prev_box > config.limit_num_points_in_prev_box, 'not enough target points'
 
     if template_transform is not None:
@@ -133,9 +145,9 @@ def motion_processing(data, config, template_transform=None, search_transform=No
     prev_points, idx_prev = points_utils.regularize_pc(prev_frame_pc.points.T, config.point_sample_size) 
     this_points, idx_this = points_utils.regularize_pc(this_frame_pc.points.T, config.point_sample_size) 
 
-    seg_label_this = geometry_utils.points_in_box(this_box, this_points.T[:3,:], 1.25).astype(int) 
-    seg_label_prev = geometry_utils.points_in_box(prev_box, prev_points.T[:3,:], 1.25).astype(int) 
-    seg_mask_prev = geometry_utils.points_in_box(ref_box, prev_points.T[:3,:], 1.25).astype(float) 
+    seg_label_this = points_utils.points_in_box(this_box, this_points.T[:3,:], 1.25).astype(int) 
+    seg_label_prev = points_utils.points_in_box(prev_box, prev_points.T[:3,:], 1.25).astype(int) 
+    seg_mask_prev = points_utils.points_in_box(ref_box, prev_points.T[:3,:], 1.25).astype(float) 
     if candidate_id != 0:
         # Here we use 0.2/0.8 instead of 0/1 to indicate that the previous box is not GT.
         # When boxcloud is used, the actual value of prior-targetness mask doesn't really matter.
@@ -186,7 +198,7 @@ def motion_processing(data, config, template_transform=None, search_transform=No
                           'candidate_bc': candidate_bc.astype('float32')})
     return data_dict
 
-def motion_processing_mf(data, config, template_transform=None, search_transform=None):
+def motion_processing_mf(data, config, template_transform=None, search_transform=None, timer=NULL_TIMER):
     """
 
     :param data:
@@ -195,7 +207,9 @@ def motion_processing_mf(data, config, template_transform=None, search_transform
     point_sample_size
     bb_scale
     bb_offset
+    :param timer: StageTimer of the DATA_STAGES
     """
+    timer.start()
     prev_frames = data['prev_frames']
     this_frame = data['this_frame']
     candidate_id = data['candidate_id']
@@ -209,10 +223,11 @@ def motion_processing_mf(data, config, template_transform=None, search_transform
 
     # Check the number of empty boxes
     for prev_box, prev_pc in zip(prev_boxs, prev_pcs):
-        num_points_in_prev_box = geometry_utils.points_in_box(prev_box, prev_pc.points[0:3,:]).sum()
+        num_points_in_prev_box = points_utils.points_in_box(prev_box, prev_pc.points[0:3,:]).sum()
         if num_points_in_prev_box < config.limit_num_points_in_prev_box:
             empty_counter += 1
     assert empty_counter < config.empty_box_limit, 'not enough valid box' 
+    timer.lap('empty_check')
 
     ref_boxs = []
     for i, prev_box in enumerate(prev_boxs): # Apply a random offset to each box, not uniformly
@@ -236,19 +251,22 @@ def motion_processing_mf(data, config, template_transform=None, search_transform
     this_frame_pc = points_utils.generate_subwindow_with_aroundboxs(this_pc, ref_boxs[0], ref_boxs[0],
                                                     scale=config.bb_scale,
                                                     offset=config.bb_offset)
+    timer.lap('crop')
 
     this_box    = points_utils.transform_box(this_box, ref_boxs[0]) 
     prev_boxs   = [points_utils.transform_box(prev_box, ref_boxs[0]) for prev_box in prev_boxs] 
     ref_boxs    = [points_utils.transform_box(ref_box, ref_boxs[0]) for ref_box in ref_boxs]    
     motion_boxs = [points_utils.transform_box(this_box, prev_box) for prev_box in prev_boxs]  
+    timer.lap('boxes')
 
     # Resample each frame of the point cloud to a specific number
     prev_points_list = [points_utils.regularize_pc(prev_frame_pc.points.T, config.point_sample_size)[0] for prev_frame_pc in prev_frame_pcs] 
     this_points = points_utils.regularize_pc(this_frame_pc.points.T, config.point_sample_size)[0] 
+    timer.lap('resample')
 
-    seg_label_this = geometry_utils.points_in_box(this_box, this_points.T[:3,:], config.bb_scale).astype(int)
-    seg_label_prev_list = [geometry_utils.points_in_box(prev_box, prev_points.T[:3,:], config.bb_scale).astype(int) for prev_box, prev_points in zip(prev_boxs, prev_points_list)] #应当只考虑xyz特征
-    seg_mask_prev_list = [geometry_utils.points_in_box(ref_box, prev_points.T[:3,:], config.bb_scale).astype(float) for ref_box,prev_points in zip(ref_boxs,prev_points_list)]#应当只考虑xyz特征
+    seg_label_this = points_utils.points_in_box(this_box, this_points.T[:3,:], config.bb_scale).astype(int)
+    seg_label_prev_list = [points_utils.points_in_box(prev_box, prev_points.T[:3,:], config.bb_scale).astype(int) for prev_box, prev_points in zip(prev_boxs, prev_points_list)] #应当只考虑xyz特征
+    seg_mask_prev_list = [points_utils.points_in_box(ref_box, prev_points.T[:3,:], config.bb_scale).astype(float) for ref_box,prev_points in zip(ref_boxs,prev_points_list)]#应当只考虑xyz特征
     if candidate_id != 0:
         for seg_mask_prev in seg_mask_prev_list:
             # Here we use 0.2/0.8 instead of 0/1 to indicate that the previous box is not GT.
@@ -326,6 +344,7 @@ def motion_processing_mf(data, config, template_transform=None, search_transform
         'seg_label': stack_seg_label.astype('int'), 
         'valid_mask': np.array(valid_mask).astype('int'), 
     }
+    timer.lap('labels')
 
     if getattr(config, 'box_aware', False):
         stack_points_split = np.split(stack_points, num_hist + 1, axis=0)
@@ -350,6 +369,7 @@ def motion_processing_mf(data, config, template_transform=None, search_transform
         data_dict.update({'prev_bc': np.stack(prev_bc_list, axis=0).astype('float32'),
                           'this_bc': this_bc.astype('float32'),
                           'candidate_bc': candidate_bc.astype('float32')})
+        timer.lap('box_cloud')
 
     return data_dict
 
@@ -428,9 +448,78 @@ class TestTrackingSampler(torch.utils.data.Dataset):
         return self.dataset.get_num_tracklets()
 
     def __getitem__(self, index):
-        tracklet_annos = self.dataset.tracklet_anno_list[index]
-        frame_ids = list(range(len(tracklet_annos)))
-        return self.dataset.get_frames(index, frame_ids)
+        if index is None:
+            # padding of TrackletDistributedSampler
+            return []
+        if getattr(self.config, 'stream_frames', False):
+            # the frames are read while tracking, the loader must run in the tracking process (no workers)
+            return FrameStream(self.dataset, index, prefetch=getattr(self.config, 'stream_prefetch', 4),
+                               history=self.config.hist_num)
+        frame_ids = list(range(self.dataset.get_num_frames_tracklet(index)))
+        # Tag the frames with their tracklet so that the tracking results can be saved per tracklet
+        return [dict(frame, tracklet_id=index) for frame in self.dataset.get_frames(index, frame_ids)]
+
+
+def balance_tracklets(lengths, num_ranks, max_items=None):
+    """
+    Greedy longest-processing-time assignment: the tracklets, longest first, go to the rank with the fewest
+    frames so far
+    :param lengths: number of frames of each tracklet
+    :param max_items: maximum number of tracklets of a rank, at least ceil(len(lengths) / num_ranks)
+    :return: the sorted tracklet indices of each rank
+    """
+    loads = [(0, rank) for rank in range(num_ranks)]
+    assignment = [[] for _ in range(num_ranks)]
+    for index in sorted(range(len(lengths)), key=lambda i: (-lengths[i], i)):
+        load, rank = heapq.heappop(loads)
+        assignment[rank].append(index)
+        if max_items is None or len(assignment[rank]) < max_items:
+            heapq.heappush(loads, (load + lengths[index], rank))
+    return [sorted(indices) for indices in assignment]
+
+
+class TrackletDistributedSampler(DistributedSampler):
+    """
+    Shards the tracklets of a TestTrackingSampler over the ranks by number of frames (balance_tracklets),
+    instead of by index. Every tracklet is evaluated exactly once. All the ranks run the same number of steps,
+    ceil(tracklets / ranks), for their collectives to match: the frames are balanced under that number of
+    tracklets per rank, and the ranks with fewer tracklets are padded with None, an empty tracklet that is
+    not scored (TestTrackingSampler).
+    The trainer initializes the process group after the loaders are built, so the ranks are resolved when
+    iterating.
+    """
+
+    def __init__(self, dataset, num_replicas=None, rank=None):
+        # DistributedSampler.__init__ requires an initialized process group
+        self.dataset = dataset
+        self.fixed_num_replicas = num_replicas
+        self.fixed_rank = rank
+        self.shuffle, self.seed, self.drop_last, self.epoch = False, 0, False, 0
+        self.lengths = [dataset.dataset.get_num_frames_tracklet(i) for i in range(len(dataset))]
+
+    @property
+    def num_replicas(self):
+        return self.fixed_num_replicas if self.fixed_num_replicas is not None else distributed_rank()[1]
+
+    @property
+    def rank(self):
+        return self.fixed_rank if self.fixed_rank is not None else distributed_rank()[0]
+
+    def num_steps(self):
+        return -(-len(self.lengths) // self.num_replicas)
+
+    def indices(self):
+        indices = balance_tracklets(self.lengths, self.num_replicas, max_items=self.num_steps())[self.rank]
+        return indices + [None] * (self.num_steps() - len(indices))
+
+    def num_frames(self):
+        return sum(self.lengths[i] for i in self.indices() if i is not None)
+
+    def __iter__(self):
+        return iter(self.indices())
+
+    def __len__(self):
+        return len(self.indices())
 
 
 class MotionTrackingSampler(PointTrackingSampler):
@@ -467,32 +556,76 @@ class MotionTrackingSamplerMF(PointTrackingSampler):
     def __init__(self, dataset, config=None, **kwargs):
         super().__init__(dataset, random_sample=False, config=config, **kwargs)
         self.processing = motion_processing_mf
+        # Cache the regions of interest of the frames across epochs. Augmentation changes the whole point
+        # clouds, so the cache is only used without it.
+        self.crop_cache = None
+        if getattr(self.config, 'crop_cache', False) and self.transform is None:
+            self.crop_cache = CropCache(dataset, self.config)
+        self.profile = getattr(self.config, 'profile_data_pipeline', False)
+        # Hits, misses and evictions of the frame cache of the dataset, reported with the data_stats
+        self.frame_cache = getattr(dataset, 'frame_cache', None)
+
+    def frame_cache_counters(self):
+        if self.frame_cache is None:
+            return np.zeros(len(FRAME_CACHE_COUNTERS), dtype=np.int64)
+        return np.array([getattr(self.frame_cache, counter) for counter in FRAME_CACHE_COUNTERS])
 
     def __getitem__(self, index):
+        # Each attempt is timed separately: the stage times of a rejected attempt all go to 'rejected'
+        timer = StageTimer(DATA_STAGES, enabled=self.profile)
+        ns = np.zeros(len(DATA_STAGES), dtype=np.int64)
+        retries = 0
+        cache_counters = self.frame_cache_counters()
+        while True:
+            timer.reset()
+            try:
+                data_dict = self.get_sample(index, timer)
+                ns += timer.ns
+                break
+            except AssertionError:
+                timer.lap('rejected')
+                ns[DATA_STAGES.index('rejected')] += timer.ns.sum()
+                retries += 1
+                index = torch.randint(0, len(self), size=(1,)).item()
+        if self.profile or self.frame_cache is not None:
+            data_dict['data_stats'] = np.concatenate([ns, [retries],
+                                                      self.frame_cache_counters() - cache_counters])
+        return data_dict
+
+    def get_sample(self, index, timer):
+        timer.start()
         anno_id = self.get_anno_index(index)
-        candidate_id = self.get_candidate_index(index) 
-        try:
-            for i in range(0, self.dataset.get_num_tracklets()):
-                if self.tracklet_start_ids[i] <= anno_id < self.tracklet_start_ids[i + 1]:
-                    tracklet_id = i
-                    this_frame_id = anno_id - self.tracklet_start_ids[i]
-                    prev_frame_ids, valid_mask = get_history_frame_ids_and_masks(this_frame_id,self.dataset.hist_num)
-
-                    frame_ids = (0, this_frame_id)
-
-            first_frame, this_frame = self.dataset.get_frames(tracklet_id, frame_ids=frame_ids)
-            prev_frames_tuple = self.dataset.get_frames(tracklet_id, frame_ids=prev_frame_ids)
-            prev_frames_dict = create_history_frame_dict(prev_frames_tuple)
-            data = {
-                "first_frame": first_frame, 
-                "prev_frames": prev_frames_dict,  
-                "this_frame": this_frame,   
-                "candidate_id": candidate_id,
-                "valid_mask":valid_mask,}
-            
-            return self.processing(data, self.config,
-                                   template_transform=self.transform,
-                                   search_transform=self.transform)
-        except AssertionError:
-            # return 1
-            return self[torch.randint(0, len(self), size=(1,)).item()]
+        candidate_id = self.get_candidate_index(index)
+        for i in range(0, self.dataset.get_num_tracklets()):
+            if self.tracklet_start_ids[i] <= anno_id < self.tracklet_start_ids[i + 1]:
+                tracklet_id = i
+                this_frame_id = anno_id - self.tracklet_start_ids[i]
+                prev_frame_ids, valid_mask = get_history_frame_ids_and_masks(this_frame_id,self.dataset.hist_num)
+
+                frame_ids = (0, this_frame_id)
+
+        if self.crop_cache is not None:
+            # The current frame is cropped around the box of the last history frame, each history frame
+            # around its own box. The first frame is not used by motion_processing_mf.
+            first_frame = None
+            this_frame = self.crop_cache.get_frame(tracklet_id, this_frame_id, prev_frame_ids[0])
+            prev_frames_tuple = [self.crop_cache.get_frame(tracklet_id, frame_id, frame_id)
+                                 for frame_id in prev_frame_ids]
+        else:
+            # a single call, for the dataset to read all the frames concurrently (frame_read_threads)
+            frames = self.dataset.get_frames(tracklet_id, frame_ids=list(frame_ids) + list(prev_frame_ids))
+            first_frame, this_frame = frames[:2]
+            prev_frames_tuple = frames[2:]
+        prev_frames_dict = create_history_frame_dict(prev_frames_tuple)
+        data = {
+            "first_frame": first_frame, 
+            "prev_frames": prev_frames_dict,  
+            "this_frame": this_frame,   
+            "candidate_id": candidate_id,
+            "valid_mask":valid_mask,}
+        timer.lap('read')
+
+        return self.processing(data, self.config,
+                               template_transform=self.transform,
+                               search_transform=self.transform,
+                               timer=timer)
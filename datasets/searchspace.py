@@ -1,5 +1,4 @@
 import numpy as np
-from pomegranate import MultivariateGaussianDistribution, GeneralMixtureModel
 import logging
 
 
@@ -52,21 +51,12 @@ class ParticleFiltering(SearchSpace):
         self.reset()
 
     def sample(self, n=10):
-        samples = []
-        for i in range(n):
-            if len(self.data) > 0:
-                i_mean = np.random.choice(
-                    list(range(len(self.data))),
-                    p=self.score / np.linalg.norm(self.score, ord=1))
-                sample = np.random.multivariate_normal(
-                    mean=self.data[i_mean], cov=np.diag(np.array(self.bnd)))
-            else:
-                sample = np.random.multivariate_normal(
-                    mean=np.zeros(len(self.bnd)),
-                    cov=np.diag(np.array(self.bnd) * 3))
-
-            samples.append(sample)
-        return np.array(samples)
+        std = np.sqrt(np.array(self.bnd, dtype=np.float64))
+        if len(self.data) > 0:
+            # Draw the parents of all the particles at once, then perturb them
+            i_mean = np.random.choice(len(self.data), size=n, p=self.score / np.linalg.norm(self.score, ord=1))
+            return self.data[i_mean] + np.random.standard_normal((n, len(std))) * std
+        return np.random.standard_normal((n, len(std))) * std * np.sqrt(3)
 
     def addData(self, data, score):
         score = score.clip(min=1e-5)  # prevent sum=0 in case of bad scores
@@ -92,67 +82,92 @@ class KalmanFiltering(SearchSpace):
 
     def addData(self, data, score):
         score = score.clip(min=1e-5)  # prevent sum=0 in case of bad scores
-        self.data = np.concatenate((self.data, data))
-        self.score = np.concatenate((self.score, score))
-        self.mean = np.average(self.data, weights=self.score, axis=0)
-        self.cov = np.cov(self.data.T, ddof=0, aweights=self.score)
+        # Weighted running sums instead of keeping every sample seen so far
+        self.sum_w += np.sum(score)
+        self.sum_wx += score @ data
+        self.sum_wxx += (data * score[:, None]).T @ data
+        self.mean = self.sum_wx / self.sum_w
+        self.cov = self.sum_wxx / self.sum_w - np.outer(self.mean, self.mean)
 
     def reset(self):
-        self.mean = np.zeros(len(self.bnd))
+        dim = len(self.bnd)
+        self.mean = np.zeros(dim)
         self.cov = np.diag(self.bnd)
-        if len(self.bnd) == 2:
-            self.data = np.array([[], []]).T
-        else:
-            self.data = np.array([[], [], []]).T
-        self.score = np.array([])
+        self.sum_w = 0.0
+        self.sum_wx = np.zeros(dim)
+        self.sum_wxx = np.zeros((dim, dim))
 
 
 class GaussianMixtureModel(SearchSpace):
 
-    def __init__(self, n_comp=5, dim=3):
+    def __init__(self, n_comp=5, dim=3, max_iter=100, tol=1e-4, reg_covar=1e-6):
         self.dim = dim
+        self.max_iter = max_iter
+        self.tol = tol
+        self.reg_covar = reg_covar
         self.reset(n_comp)
 
+    @staticmethod
+    def sample_gaussians(weights, means, covs, n):
+        """
+        Draw n samples from the mixture of the gaussians (means, covs) with the given weights
+        """
+        comp = np.random.choice(len(weights), size=n, p=weights / np.sum(weights))
+        chol = np.linalg.cholesky(covs)  # K,D,D
+        noise = np.random.standard_normal((n, means.shape[1]))
+        return means[comp] + np.einsum('nij,nj->ni', chol[comp], noise)
+
     def sample(self, n=10):
-        try:
-            X1 = np.stack(self.model.sample(int(np.round(0.8 * n))))
-            if self.dim == 2:
-                mean = np.mean(X1, axis=0)
-                std = np.diag([1.0, 1.0])
-                gmm = MultivariateGaussianDistribution(mean, std)
-                X2 = np.stack(gmm.sample(int(np.round(0.1 * n))))
-
-                mean = np.mean(X1, axis=0)
-                std = np.diag([1e-3, 1e-3])
-                gmm = MultivariateGaussianDistribution(mean, std)
-                X3 = np.stack(gmm.sample(int(np.round(0.1 * n))))
-
-            else:
-                mean = np.mean(X1, axis=0)
-                std = np.diag([1.0, 1.0, 1e-3])
-                gmm = MultivariateGaussianDistribution(mean, std)
-                X2 = np.stack(gmm.sample(int(np.round(0.1 * n))))
-
-                mean = np.mean(X1, axis=0)
-                std = np.diag([1e-3, 1e-3, 10.0])
-                gmm = MultivariateGaussianDistribution(mean, std)
-                X3 = np.stack(gmm.sample(int(np.round(0.1 * n))))
-
-            X = np.concatenate((X1, X2, X3))
-
-        except ValueError:
-            print("exception caught on sampling")
-            if self.dim == 2:
-                mean = np.zeros(self.dim)
-                std = np.diag([1.0, 1.0])
-                gmm = MultivariateGaussianDistribution(mean, std)
-                X = gmm.sample(int(n))
-            else:
-                mean = np.zeros(self.dim)
-                std = np.diag([1.0, 1.0, 5.0])
-                gmm = MultivariateGaussianDistribution(mean, std)
-                X = gmm.sample(int(n))
-        return X
+        X1 = self.sample_gaussians(self.weights, self.means, self.covs, int(np.round(0.8 * n)))
+        mean = np.mean(X1, axis=0) if len(X1) > 0 else np.zeros(self.dim)
+        if self.dim == 2:
+            var2, var3 = [1.0, 1.0], [1e-3, 1e-3]
+        else:
+            var2, var3 = [1.0, 1.0, 1e-3], [1e-3, 1e-3, 10.0]
+        n_extra = int(np.round(0.1 * n))
+        X2 = mean + np.random.standard_normal((n_extra, self.dim)) * np.sqrt(var2)
+        X3 = mean + np.random.standard_normal((n_extra, self.dim)) * np.sqrt(var3)
+        return np.concatenate((X1, X2, X3))
+
+    def fit(self, X, sample_weight):
+        """
+        Weighted EM, initialised with k-means++ seeding
+        :return: weights <K>, means <K,D>, covs <K,D,D>
+        """
+        N, D = X.shape
+        K = self.n_comp
+        w = sample_weight / np.sum(sample_weight)
+
+        means = [X[np.random.choice(N, p=w)]]
+        for _ in range(1, K):
+            d2 = np.min(np.sum((X[:, None] - np.array(means)[None]) ** 2, axis=-1), axis=1) * w
+            means.append(X[np.random.choice(N, p=d2 / d2.sum())] if d2.sum() > 0 else X[np.random.choice(N, p=w)])
+        means = np.array(means)
+        covs = np.tile(np.cov(X.T, aweights=w, ddof=0) + self.reg_covar * np.eye(D), (K, 1, 1))
+        weights = np.full(K, 1.0 / K)
+
+        prev_ll = -np.inf
+        for _ in range(self.max_iter):
+            # E-step
+            chol = np.linalg.cholesky(covs)
+            diff = np.linalg.solve(chol[None], (X[:, None] - means[None])[..., None])[..., 0]  # N,K,D
+            log_det = 2 * np.sum(np.log(np.diagonal(chol, axis1=1, axis2=2)), axis=1)
+            log_prob = -0.5 * (np.sum(diff ** 2, axis=-1) + log_det + D * np.log(2 * np.pi)) + np.log(weights)
+            log_norm = np.logaddexp.reduce(log_prob, axis=1)
+            resp = np.exp(log_prob - log_norm[:, None]) * w[:, None]  # N,K
+
+            # M-step
+            nk = resp.sum(axis=0) + 10 * np.finfo(float).eps
+            weights = nk / nk.sum()
+            means = resp.T @ X / nk[:, None]
+            diff = X[:, None] - means[None]
+            covs = np.einsum('nk,nki,nkj->kij', resp, diff, diff) / nk[:, None, None] + self.reg_covar * np.eye(D)
+
+            ll = np.sum(w * log_norm)
+            if ll - prev_ll < self.tol:
+                break
+            prev_ll = ll
+        return weights, means, covs
 
     def addData(self, data, score):
         score = score.clip(min=1e-5)
@@ -161,13 +176,10 @@ class GaussianMixtureModel(SearchSpace):
 
         score_normed = self.score / np.linalg.norm(self.score, ord=1)
         try:
-            model = GeneralMixtureModel.from_samples(
-                MultivariateGaussianDistribution,
-                n_components=self.n_comp,
-                X=self.data,
-                weights=score_normed)
-            self.model = model
-        except:
+            weights, means, covs = self.fit(self.data, score_normed)
+            if np.all(np.isfinite(means)) and np.all(np.isfinite(covs)):
+                self.weights, self.means, self.covs = weights, means, covs
+        except (np.linalg.LinAlgError, ValueError):
             logging.info("catched an exception")
 
     def reset(self, n_comp=5):
@@ -179,9 +191,10 @@ class GaussianMixtureModel(SearchSpace):
             self.data = np.array([[], [], []]).T
         self.score = np.ones(np.shape(self.data)[0])
         self.score = self.score / np.linalg.norm(self.score, ord=1)
+        # A single gaussian until data is added
+        self.weights = np.ones(1)
+        self.means = np.zeros((1, self.dim))
         if self.dim == 2:
-            self.model = MultivariateGaussianDistribution(
-                np.zeros(self.dim), np.diag([1.0, 1.0]))
+            self.covs = np.diag([1.0, 1.0])[None]
         else:
-            self.model = MultivariateGaussianDistribution(
-                np.zeros(self.dim), np.diag([1.0, 1.0, 5.0]))
+            self.covs = np.diag([1.0, 1.0, 5.0])[None]
@@ -0,0 +1,136 @@
+"""
+shards.py
+Training samples of MotionTrackingSamplerMF materialized into npz shards, and streamed back for training
+"""
+import itertools
+import json
+import os
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import DataLoader
+
+MANIFEST = 'manifest.json'
+
+# Options the exported samples depend on, checked against the training config when streaming them
+SHARD_CONFIG_KEYS = ('dataset', 'category_name', 'train_split', 'hist_num', 'point_sample_size', 'bb_scale',
+                     'bb_offset', 'degrees', 'data_limit_box', 'num_candidates', 'motion_threshold',
+                     'limit_num_points_in_prev_box', 'empty_box_limit', 'use_augmentation', 'box_aware')
+
+# Keys of the samples describing how they were read at export time (datasets.sampler DATA_STAGES), not stored
+# in the shards nor streamed back: training from shards does not run the data pipeline
+EXPORT_ONLY_KEYS = ('data_stats',)
+
+
+def stack_samples(samples):
+    return {k: np.stack([sample[k] for sample in samples]) for k in samples[0]}
+
+
+def export_shards(sampler, shard_dir, num_epochs, shard_size=1000, workers=0, config=None):
+    """
+    Run `num_epochs` epochs of the sampler and save the processed samples, `shard_size` samples per npz file,
+    without their EXPORT_ONLY_KEYS
+    :param config: the training config, its SHARD_CONFIG_KEYS are stored in the manifest
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    shards = []
+    for epoch in range(num_epochs):
+        loader = DataLoader(sampler, batch_size=shard_size, shuffle=True, num_workers=workers,
+                            collate_fn=stack_samples)
+        for i, batch in enumerate(loader):
+            batch = {k: v for k, v in batch.items() if k not in EXPORT_ONLY_KEYS}
+            file_name = f'epoch{epoch:03d}_shard{i:05d}.npz'
+            np.savez(os.path.join(shard_dir, file_name), **batch)
+            shards.append({'file': file_name, 'epoch': epoch, 'num_samples': len(batch['points'])})
+        print(f'exported epoch {epoch}: {sum(s["num_samples"] for s in shards if s["epoch"] == epoch)} samples')
+
+    manifest = {'num_epochs': num_epochs, 'shards': shards,
+                'config': {k: config.get(k) for k in SHARD_CONFIG_KEYS} if config is not None else {}}
+    with open(os.path.join(shard_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+
+def distributed_rank():
+    """
+    :return: (rank, world_size) of this process, (0, 1) without torch.distributed
+    """
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
+
+
+class ShardedSampleDataset(torch.utils.data.IterableDataset):
+    """
+    Streams the samples written by export_shards. Training epoch e reads the shards of exported epoch
+    e % num_epochs, shuffled across the ranks and data loading workers (the streams), and shuffles the
+    samples of each stream in a buffer. Every stream yields the same number of samples, so that all the
+    ranks run the same number of steps.
+    Call set_epoch at the start of every epoch.
+    """
+
+    def __init__(self, shard_dir, config=None, shuffle_buffer=4000, num_workers=0, seed=0):
+        """
+        :param config: the training config, checked against the config of the export
+        :param num_workers: data loading workers per rank, only used by __len__
+        """
+        with open(os.path.join(shard_dir, MANIFEST), 'r') as f:
+            self.manifest = json.load(f)
+        if config is not None:
+            mismatch = {k: (v, config.get(k)) for k, v in self.manifest['config'].items() if config.get(k) != v}
+            if len(mismatch) > 0:
+                raise ValueError(f'the shards in {shard_dir} were exported with a different config '
+                                 f'(exported, current): {mismatch}')
+        self.shard_dir = shard_dir
+        self.shuffle_buffer = shuffle_buffer
+        self.num_workers = num_workers
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def stream_shards(self, num_streams):
+        """
+        :return: the shards each stream reads this epoch, the number of samples every stream yields
+        """
+        shards = [s for s in self.manifest['shards'] if s['epoch'] == self.epoch % self.manifest['num_epochs']]
+        if len(shards) < num_streams:
+            raise ValueError(f'{len(shards)} shards per epoch cannot feed {num_streams} ranks x workers, '
+                             f'export them with a smaller shard_size')
+        order = np.random.default_rng([self.seed, self.epoch]).permutation(len(shards))
+        streams = [[shards[i] for i in order[stream::num_streams]] for stream in range(num_streams)]
+        num_samples = min(sum(s['num_samples'] for s in stream) for stream in streams)
+        return streams, num_samples
+
+    def __len__(self):
+        num_workers = max(1, self.num_workers)
+        _, num_samples = self.stream_shards(distributed_rank()[1] * num_workers)
+        return num_samples * num_workers
+
+    def read_samples(self, shards):
+        for shard in shards:
+            with np.load(os.path.join(self.shard_dir, shard['file'])) as f:
+                # shards exported with their data_stats are streamed without them
+                arrays = {k: f[k] for k in f.files if k not in EXPORT_ONLY_KEYS}
+            for i in range(shard['num_samples']):
+                yield {k: v[i] for k, v in arrays.items()}
+
+    def __iter__(self):
+        rank, world_size = distributed_rank()
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        stream = rank * num_workers + worker_id
+        streams, num_samples = self.stream_shards(world_size * num_workers)
+        rng = np.random.default_rng([self.seed, self.epoch, stream])
+
+        buffer = []
+        for sample in itertools.islice(self.read_samples(streams[stream]), num_samples):
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            i = rng.integers(len(buffer))
+            buffer[i], sample = sample, buffer[i]
+            yield sample
+        for i in rng.permutation(len(buffer)):
+            yield buffer[i]
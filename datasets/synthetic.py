@@ -0,0 +1,154 @@
+"""
+synthetic.py
+Procedurally generated tracking scenes, for profiling training and testing without a real dataset
+"""
+import zlib
+
+import numpy as np
+from pyquaternion import Quaternion
+
+from datasets import points_utils, base_dataset
+from datasets.data_classes import PointCloud, Box
+
+# wlh and speed range (m/s) of the generated objects
+CATEGORY_SIZES = {'car': [1.95, 4.6, 1.73], 'pedestrian': [0.67, 0.73, 1.77], 'cyclist': [0.6, 1.7, 1.3],
+                  'truck': [2.5, 7.0, 3.0]}
+CATEGORY_SPEEDS = {'car': (2., 15.), 'pedestrian': (0.5, 2.), 'cyclist': (2., 7.), 'truck': (2., 12.)}
+CATEGORY_ALIASES = {'vehicle': 'car', 'bicycle': 'cyclist'}
+
+
+def sample_box_surface(center, wlh, yaw, n, rng):
+    """
+    Points on the faces of a box seen from a sensor at the origin, the bottom face excluded
+    :return: <np.float: 3, n>
+    """
+    w, l, h = wlh
+    # (normal axis, sign, area) of the faces in the box frame, x along the length
+    faces = [(0, 1, w * h), (0, -1, w * h), (1, 1, l * h), (1, -1, l * h), (2, 1, l * w)]
+    half = np.array([l, w, h]) / 2
+    rot = np.array([[np.cos(yaw), -np.sin(yaw), 0], [np.sin(yaw), np.cos(yaw), 0], [0, 0, 1]])
+    to_sensor = rot.T @ -np.asarray(center)
+    visible = [(axis, sign, area) for axis, sign, area in faces if sign * (to_sensor[axis] - sign * half[axis]) > 0]
+    if len(visible) == 0:  # the sensor is inside the box
+        return np.zeros((3, 0))
+    areas = np.array([area for *_, area in visible])
+    face_ids = rng.choice(len(visible), size=n, p=areas / areas.sum())
+
+    points = rng.uniform(-half, half, size=(n, 3))
+    for i, (axis, sign, _) in enumerate(visible):
+        points[face_ids == i, axis] = sign * half[axis]
+    points = points @ rot.T + center
+    return (points + rng.normal(scale=0.02, size=points.shape)).T
+
+
+class SyntheticDataset(base_dataset.BaseDataset):
+    """
+    Tracklets of boxes moving with a noisy speed and turn rate around a static sensor, observed by a
+    LiDAR-like scan: ground rings, points on the faces of the target facing the sensor, with a density
+    falling with the squared range, and static distractor objects. Frames are generated on the fly, and
+    are deterministic given the seed, the split, the tracklet and the frame.
+    """
+
+    def __init__(self, path=None, split='train', category_name='Car', **kwargs):
+        super().__init__(path, split, category_name, **kwargs)
+        category = category_name.lower()
+        category = CATEGORY_ALIASES.get(category, category)
+        self.size = np.array(CATEGORY_SIZES.get(category, CATEGORY_SIZES['car']))
+        self.speed_range = CATEGORY_SPEEDS.get(category, CATEGORY_SPEEDS['car'])
+
+        self.num_tracklets = kwargs.get('num_tracklets', 200)
+        self.tracklet_length = kwargs.get('tracklet_length', (20, 60))
+        self.scene_points = kwargs.get('scene_points', 20000)  # ground and distractor points of a frame
+        self.object_points = kwargs.get('object_points', 400)  # points on a target 10 meters away
+        self.num_distractors = kwargs.get('num_distractors', 8)
+        self.frame_interval = kwargs.get('frame_interval', 0.5)  # seconds
+        self.static_ratio = kwargs.get('static_ratio', 0.3)
+        self.empty_ratio = kwargs.get('empty_ratio', 0.02)  # frames where the target is fully occluded
+        self.max_range = kwargs.get('max_range', 60.)
+        self.sensor_height = kwargs.get('sensor_height', 1.8)
+        self.preload_offset = kwargs.get('preload_offset', -1)
+        self.seed = [kwargs.get('seed', 0), zlib.crc32(split.encode())]
+
+        self.tracklets = [self._generate_tracklet(i) for i in range(self.num_tracklets)]
+        self.tracklet_len_list = [len(tracklet['yaws']) for tracklet in self.tracklets]
+        if self.preloading:
+            self.training_samples = self.compress_preloaded([[self._generate_frame(i, f) for f in range(n)]
+                                                             for i, n in enumerate(self.tracklet_len_list)])
+
+        self.hist_num = kwargs.get('hist_num', 1)
+
+    def _generate_tracklet(self, tracklet_id):
+        rng = np.random.default_rng(self.seed + [tracklet_id])
+        length = rng.integers(self.tracklet_length[0], self.tracklet_length[1] + 1)
+        wlh = self.size * rng.uniform(0.9, 1.1, size=3)
+
+        distance, azimuth = rng.uniform(5, self.max_range / 2), rng.uniform(-np.pi, np.pi)
+        position = distance * np.array([np.cos(azimuth), np.sin(azimuth)])
+        yaw = rng.uniform(-np.pi, np.pi)
+        static = rng.random() < self.static_ratio
+        speed = 0. if static else rng.uniform(*self.speed_range)
+        yaw_rate = 0. if static else rng.normal(scale=0.15)
+
+        positions, yaws = [], []
+        for _ in range(length):
+            positions.append(position.copy())
+            yaws.append(yaw)
+            if not static:
+                speed = max(speed + rng.normal(scale=1.0) * self.frame_interval, 0.)
+                yaw_rate += rng.normal(scale=0.05)
+                yaw += yaw_rate * self.frame_interval
+                position += speed * self.frame_interval * np.array([np.cos(yaw), np.sin(yaw)])
+        z = -self.sensor_height + wlh[2] / 2
+        centers = np.concatenate([np.array(positions), np.full((length, 1), z)], axis=1)
+
+        # Static objects around the trajectory: (center, wlh, yaw)
+        distractors = []
+        for _ in range(self.num_distractors):
+            d_wlh = self.size * rng.uniform(0.5, 1.5, size=3)
+            d_center = centers[rng.integers(length), :2] + rng.uniform(-15, 15, size=2)
+            distractors.append((np.append(d_center, -self.sensor_height + d_wlh[2] / 2), d_wlh,
+                                rng.uniform(-np.pi, np.pi)))
+        return {'centers': centers, 'yaws': np.array(yaws), 'wlh': wlh, 'distractors': distractors}
+
+    def _generate_frame(self, tracklet_id, frame_id):
+        tracklet = self.tracklets[tracklet_id]
+        rng = np.random.default_rng(self.seed + [tracklet_id, frame_id])
+        center, yaw, wlh = tracklet['centers'][frame_id], tracklet['yaws'][frame_id], tracklet['wlh']
+
+        # Ground: LiDAR rings below the horizon
+        num_ground = self.scene_points // 2
+        elevations = np.deg2rad(np.linspace(-25, -1, 32))
+        ranges = self.sensor_height / np.tan(-elevations[rng.integers(len(elevations), size=num_ground)])
+        ranges = np.minimum(ranges * rng.normal(1, 0.01, size=num_ground), self.max_range)
+        azimuths = rng.uniform(-np.pi, np.pi, size=num_ground)
+        ground = np.stack([ranges * np.cos(azimuths), ranges * np.sin(azimuths),
+                           rng.normal(-self.sensor_height, 0.03, size=num_ground)])
+
+        objects = [ground]
+        for d_center, d_wlh, d_yaw in tracklet['distractors']:
+            n = rng.poisson((self.scene_points - num_ground) / max(self.num_distractors, 1))
+            objects.append(sample_box_surface(d_center, d_wlh, d_yaw, n, rng))
+        if rng.random() >= self.empty_ratio:
+            density = self.object_points * (10 / max(np.linalg.norm(center[:2]), 1.)) ** 2
+            objects.append(sample_box_surface(center, wlh, yaw, rng.poisson(min(density, 10 * self.object_points)),
+                                              rng))
+
+        pc = PointCloud(np.concatenate(objects, axis=1))
+        bb = Box(center, wlh, Quaternion(axis=[0, 0, 1], radians=yaw), name=self.category_name)
+        if self.preload_offset > 0:
+            pc = points_utils.crop_pc_axis_aligned(pc, bb, offset=self.preload_offset)
+        return {"pc": pc, "3d_bbox": bb, 'meta': {'tracklet_id': tracklet_id, 'frame_id': frame_id}}
+
+    def get_num_tracklets(self):
+        return self.num_tracklets
+
+    def get_num_frames_total(self):
+        return sum(self.tracklet_len_list)
+
+    def get_num_frames_tracklet(self, tracklet_id):
+        return self.tracklet_len_list[tracklet_id]
+
+    def get_frames(self, seq_id, frame_ids):
+        if self.preloading:
+            return self.get_preloaded_frames(seq_id, frame_ids)
+        return self.read_frames(seq_id, frame_ids, lambda f_id: self._generate_frame(seq_id, f_id))
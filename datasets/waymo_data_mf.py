@@ -46,7 +46,7 @@ class WaymoDataset(base_dataset.BaseDataset):
 
         self.preload_offset = kwargs.get('preload_offset', 10)
         if self.preloading:
-            self.training_samples = self._load_data()
+            self.training_samples = self.compress_preloaded(self._load_data())
 
         self.hist_num = kwargs.get('hist_num', 1) 
 
@@ -113,10 +113,10 @@ class WaymoDataset(base_dataset.BaseDataset):
 
     def get_frames(self, seq_id, frame_ids):
         if self.preloading:
-            frames = [self.training_samples[seq_id][f_id] for f_id in frame_ids]
+            frames = self.get_preloaded_frames(seq_id, frame_ids)
         else:
             seq_annos = self.tracklet_anno_list[seq_id]
-            frames = [self._get_frame_from_anno(seq_annos[f_id]) for f_id in frame_ids]
+            frames = self.read_frames(seq_id, frame_ids, lambda f_id: self._get_frame_from_anno(seq_annos[f_id]))
 
         return frames
 
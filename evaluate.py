@@ -0,0 +1,133 @@
+"""
+evaluate.py
+Test a checkpoint on the CPU with a pool of processes. The model is loaded once and forked: every process tracks
+whole tracklets with its own replica and a fixed number of threads, the longest tracklets first.
+
+python evaluate.py --cfg cfgs/seqtrack3d_nuscenes.yaml --checkpoint pretrainedmodel/<checkpoint>.ckpt --processes 16 --threads 4
+
+Tracking a tracklet is sequential, tracklets are independent. The random number generators (point resampling,
+hypotheses) are seeded by tracklet, so the metrics do not depend on the number of processes.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+import torch
+import yaml
+from easydict import EasyDict
+
+from datasets import get_dataset
+from datasets.frame_stream import tracklet_boxes
+from models import get_model
+from utils.metrics import TorchStreamingSuccess, TorchStreamingPrecision
+from utils.tracking_results import save_tracking_results
+
+# The replica of the model, the test tracklets and the seed of the processes of the pool, inherited when forking
+_net = None
+_data = None
+_seed = 0
+
+
+def init_process(threads):
+    torch.set_num_threads(threads)
+
+
+def track(index):
+    """
+    :return: index, ious, distances, the gt and predicted boxes and the seconds spent tracking tracklet `index`
+    """
+    random.seed(_seed + index)
+    np.random.seed(_seed + index)
+    torch.manual_seed(_seed + index)
+    sequence = _data[index]
+    start = time.perf_counter()
+    with torch.no_grad():
+        ious, distances, results_bbs, _ = _net.evaluate_one_sequence(sequence)
+    return index, ious, distances, tracklet_boxes(sequence), results_bbs, time.perf_counter() - start
+
+
+def evaluate(net, data, processes, threads=1, seed=0):
+    """
+    Tracks all the tracklets of `data` with `processes` forked replicas of `net`
+    :param seed: tracklet i is tracked with the random generators seeded with seed + i
+    :return: dict of success, precision, number of frames and tracklets, wall and tracking seconds, and the
+        (tracklet_id, gt boxes, predicted boxes) of the tracklets
+    """
+    global _net, _data, _seed
+    _net, _data, _seed = net.eval(), data, seed
+    lengths = [data.dataset.get_num_frames_tracklet(i) for i in range(len(data))]
+    # longest first, so that the last tracklets left to a busy pool are short
+    order = sorted(range(len(data)), key=lambda i: -lengths[i])
+
+    success, precision = TorchStreamingSuccess(), TorchStreamingPrecision()
+    tracklets, tracking_seconds = [], 0.
+    start = time.perf_counter()
+    if processes <= 1:
+        init_process(threads)
+        results = map(track, order)
+        pool = None
+    else:
+        pool = multiprocessing.get_context('fork').Pool(processes, initializer=init_process, initargs=(threads,))
+        results = pool.imap_unordered(track, order)
+    for index, ious, distances, gt_bbs, results_bbs, seconds in results:
+        success(torch.tensor(ious))
+        precision(torch.tensor(distances))
+        tracklets.append((index, gt_bbs, results_bbs))
+        tracking_seconds += seconds
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    return {'success': float(success.compute()), 'precision': float(precision.compute()),
+            'frames': sum(lengths), 'tracklets': len(lengths), 'seconds': time.perf_counter() - start,
+            'tracking_seconds': tracking_seconds, 'results': sorted(tracklets, key=lambda t: t[0])}
+
+
+def load_model(config, checkpoint):
+    net = get_model(config.net_model)(config)
+    if checkpoint is not None:
+        # the checkpoint stores the training config as an EasyDict, beside the weights
+        state_dict = torch.load(checkpoint, map_location='cpu', weights_only=False)['state_dict']
+        net.load_state_dict(state_dict)
+    return net
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cfg', type=str, help='the config_file')
+    parser.add_argument('--checkpoint', type=str, default=None, help='checkpoint location')
+    parser.add_argument('--split', type=str, default=None, help='split to evaluate, test_split of the config by default')
+    parser.add_argument('--processes', type=int, default=None, help='cpu count / threads by default')
+    parser.add_argument('--threads', type=int, default=1, help='torch threads of each process')
+    parser.add_argument('--seed', type=int, default=0, help='random_seed')
+    parser.add_argument('--preloading', action='store_true', default=False, help='preload dataset into memory')
+    parser.add_argument('--save_results', type=str, default=None,
+                        help='npz file the per-frame boxes are saved to, for score_results.py')
+    args = parser.parse_args()
+
+    with open(args.cfg, 'r') as f:
+        config = EasyDict(yaml.load(f, Loader=yaml.FullLoader))
+    config.update(cfg=args.cfg, checkpoint=args.checkpoint, preloading=args.preloading)
+    processes = args.processes or max(os.cpu_count() // args.threads, 1)
+
+    torch.manual_seed(args.seed)  # weights of an untrained model
+    net = load_model(config, args.checkpoint)
+    data = get_dataset(config, type='test', split=args.split or config.test_split)
+    metrics = evaluate(net, data, processes, threads=args.threads, seed=args.seed)
+
+    print('| processes | threads | tracklets | frames | success | precision | seconds | frames per second |')
+    print('|---|---|---|---|---|---|---|---|')
+    print(f"| {processes} | {args.threads} | {metrics['tracklets']} | {metrics['frames']} | "
+          f"{metrics['success']:.2f} | {metrics['precision']:.2f} | {metrics['seconds']:.1f} | "
+          f"{metrics['frames'] / metrics['seconds']:.1f} |")
+    print(f"tracking time summed over the processes: {metrics['tracking_seconds']:.1f} s, "
+          f"parallel efficiency {metrics['tracking_seconds'] / (processes * metrics['seconds']):.2f}")
+    if args.save_results is not None:
+        save_tracking_results(args.save_results, metrics['results'], checkpoint=args.checkpoint)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,15 +18,14 @@ from pytorch_lightning import seed_everything
 
 
 from datasets import get_dataset
+from datasets.sampler import TrackletDistributedSampler
+from datasets.chunk_sampler import ChunkedBatchSampler
+from datasets.shards import export_shards, ShardedSampleDataset
 from models import get_model
 
 torch.set_float32_matmul_precision("high")
 
-import matplotlib.pyplot as plt
-import sys
-
 import datetime
-import time
 
 def generate_log_folder_name(cfg):
     now = datetime.datetime.now()
@@ -56,6 +55,10 @@ def parse_config():
     parser.add_argument('--log_dir', type=str, default=None, help='log location')
     parser.add_argument('--test', action='store_true', default=False, help='test mode')
     parser.add_argument('--preloading', action='store_true', default=False, help='preload dataset into memory')
+    parser.add_argument('--save_results', action='store_true', default=False,
+                        help='save the per-frame boxes of the test tracklets for score_results.py')
+    parser.add_argument('--export_shards', type=int, default=None,
+                        help='export this number of epochs of processed training samples to shard_dir and exit')
     parser.add_argument('--tag', type=str, default="", help='an extra tag appended on output folder name')
     parser.add_argument('--seed', type=int, help='random_seed')
 
@@ -85,24 +88,49 @@ except KeyError:
     pass
 
 
-if not cfg.test:
-    # dataset and dataloader
+# A FrameStream reads the frames of the tracklet with a thread of the tracking process (stream_frames)
+test_workers = 0 if cfg.get('stream_frames', False) else cfg.workers
+
+if cfg.export_shards is not None:
     train_data = get_dataset(cfg, type=cfg.train_type, split=cfg.train_split)
+    export_shards(train_data, cfg.shard_dir, cfg.export_shards, shard_size=cfg.shard_size, workers=cfg.workers,
+                  config=cfg)
+elif not cfg.test:
+    # dataset and dataloader
+    if cfg.get('shard_dir', None) is not None:
+        # stream the samples exported with --export_shards, shuffled by the dataset itself
+        train_data = ShardedSampleDataset(cfg.shard_dir, config=cfg, shuffle_buffer=cfg.shard_shuffle_buffer,
+                                          num_workers=cfg.workers, seed=cfg.seed or 0)
+        train_loader = DataLoader(train_data, batch_size=cfg.batch_size, num_workers=cfg.workers, drop_last=True,
+                                  pin_memory=True)
+    elif cfg.get('chunk_shuffle', False):
+        # shuffled by chunks of consecutive frames, sharded over the ranks by the batch sampler itself
+        train_data = get_dataset(cfg, type=cfg.train_type, split=cfg.train_split)
+        batch_sampler = ChunkedBatchSampler(train_data, cfg.batch_size, num_workers=cfg.workers,
+                                            chunk_frames=cfg.chunk_frames, mix_chunks=cfg.chunk_mix,
+                                            seed=cfg.seed or 0)
+        train_loader = DataLoader(train_data, batch_sampler=batch_sampler, num_workers=cfg.workers, pin_memory=True)
+    else:
+        train_data = get_dataset(cfg, type=cfg.train_type, split=cfg.train_split)
+        train_loader = DataLoader(train_data, batch_size=cfg.batch_size, num_workers=cfg.workers, shuffle=True,drop_last=True,
+                                  pin_memory=True)
     val_data = get_dataset(cfg, type='test', split=cfg.val_split)
-    train_loader = DataLoader(train_data, batch_size=cfg.batch_size, num_workers=cfg.workers, shuffle=True,drop_last=True,
-                              pin_memory=True)
-    val_loader = DataLoader(val_data, batch_size=1, num_workers=cfg.workers, collate_fn=lambda x: x, pin_memory=True)
+    # the tracklets are sharded over the ranks by number of frames
+    val_loader = DataLoader(val_data, batch_size=1, num_workers=test_workers, collate_fn=lambda x: x, pin_memory=True,
+                            sampler=TrackletDistributedSampler(val_data))
     checkpoint_callback = ModelCheckpoint(monitor='precision/test', mode='max', save_last=True,
                                           save_top_k=cfg.save_top_k)
     learningrate_callback = LearningRateMonitor(logging_interval="step")
 
     # init trainer
-    trainer = pl.Trainer(devices=-1, accelerator='auto', max_epochs=cfg.epoch,
+    trainer = pl.Trainer(devices='auto', accelerator='auto', max_epochs=cfg.epoch,
                          callbacks=[checkpoint_callback,learningrate_callback],
                          default_root_dir=generate_log_folder_name(cfg),
                          check_val_every_n_epoch=cfg.check_val_every_n_epoch,
                          num_sanity_val_steps=0,
                          gradient_clip_val=cfg.gradient_clip_val,
+                         # the chunked batch sampler shards the training samples over the ranks
+                         use_distributed_sampler=not cfg.get('chunk_shuffle', False),
                          fast_dev_run=False)
     # init model
     train_dataloader_length = len(train_loader) #用于设置OneCycle学习率
@@ -114,9 +142,10 @@ if not cfg.test:
     trainer.fit(net, train_loader, val_loader, ckpt_path=cfg.checkpoint)
 else:
     test_data = get_dataset(cfg, type='test', split=cfg.test_split)
-    test_loader = DataLoader(test_data, batch_size=1, num_workers=cfg.workers, collate_fn=lambda x: x, pin_memory=True)
+    test_loader = DataLoader(test_data, batch_size=1, num_workers=test_workers, collate_fn=lambda x: x, pin_memory=True,
+                             sampler=TrackletDistributedSampler(test_data))
 
-    trainer = pl.Trainer(devices=-1, accelerator='auto', default_root_dir=generate_log_folder_name(cfg))
+    trainer = pl.Trainer(devices='auto', accelerator='auto', default_root_dir=generate_log_folder_name(cfg))
 
     if cfg.checkpoint is None:
         net = get_model(cfg.net_model)(cfg)
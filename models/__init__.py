@@ -2,9 +2,10 @@
 __init__.py
 Created by zenn at 2021/7/15 21:40
 """
+import importlib
 
-from models import seqtrack3d
 
 def get_model(name):
-    model = globals()[name.lower()].__getattribute__(name.upper())
+    # models/<name>.py is only imported when its model is requested
+    model = importlib.import_module(f'models.{name.lower()}').__getattribute__(name.upper())
     return model
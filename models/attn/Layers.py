@@ -14,9 +14,9 @@ class EncoderLayer(nn.Module):
         self.slf_attn = MultiHeadAttention(n_head, d_model, d_k, d_v, dropout=dropout)
         self.pos_ffn = PositionwiseFeedForward(d_model, d_inner, dropout=dropout)
 
-    def forward(self, enc_input, slf_attn_mask=None):
+    def forward(self, enc_input, slf_attn_mask=None, return_attns=False):
         enc_output, enc_slf_attn = self.slf_attn(
-            enc_input, enc_input, enc_input, mask=slf_attn_mask)
+            enc_input, enc_input, enc_input, mask=slf_attn_mask, return_attns=return_attns)
         enc_output = self.pos_ffn(enc_output)
         return enc_output, enc_slf_attn
 
@@ -30,9 +30,9 @@ class DecoderLayer(nn.Module):
 
     def forward(
             self, dec_input, enc_output,
-            slf_attn_mask=None, dec_enc_attn_mask=None):
+            slf_attn_mask=None, dec_enc_attn_mask=None, return_attns=False):
         dec_output, dec_enc_attn = self.enc_attn(
-            dec_input, enc_output, enc_output, mask=dec_enc_attn_mask)
+            dec_input, enc_output, enc_output, mask=dec_enc_attn_mask, return_attns=return_attns)
         dec_output = self.pos_ffn(dec_output)
         return dec_output, None, dec_enc_attn
 
@@ -33,7 +33,7 @@ class Encoder(nn.Module):
             enc_output = self.dropout(self.with_pos_embed(src_seq)) 
 
         for enc_layer in self.layer_stack:
-            enc_output, enc_slf_attn = enc_layer(enc_output, slf_attn_mask=src_mask) # vanilla attention mechanism
+            enc_output, enc_slf_attn = enc_layer(enc_output, slf_attn_mask=src_mask, return_attns=return_attns) # vanilla attention mechanism
             enc_slf_attn_list += [enc_slf_attn] if return_attns else []
 
         if return_attns:
@@ -64,7 +64,8 @@ class Decoder(nn.Module):
 
         for dec_layer in self.layer_stack:
             dec_output, dec_slf_attn, dec_enc_attn = dec_layer(
-                dec_output, enc_output, slf_attn_mask=trg_mask, dec_enc_attn_mask=src_mask)
+                dec_output, enc_output, slf_attn_mask=trg_mask, dec_enc_attn_mask=src_mask,
+                return_attns=return_attns)
             dec_slf_attn_list += [dec_slf_attn] if return_attns else []
             dec_enc_attn_list += [dec_enc_attn] if return_attns else []
 
@@ -83,11 +84,12 @@ class Seq2SeqFormer(nn.Module):
     def __init__(
             self, src_pad_idx=1, trg_pad_idx=1,
             d_word_vec=64, d_model=64, d_inner=512,
-            n_layers=3, n_head=8, d_k=32, d_v=32, dropout=0.2, n_position=100):
+            n_layers=3, n_head=8, d_k=32, d_v=32, dropout=0.2, n_position=100, use_valid_mask=False):
 
         super().__init__()
         
         self.d_model=d_model
+        self.use_valid_mask=use_valid_mask # Mask the point tokens of padded history frames out of attention
         self.src_pad_idx, self.trg_pad_idx = src_pad_idx, trg_pad_idx
         self.proj=nn.Linear(128,d_model) 
         self.proj2=nn.Linear(4,d_model) # 4 represents the dimensions for x, y, z, plus a time stamp
@@ -123,23 +125,45 @@ class Seq2SeqFormer(nn.Module):
          the dimensions of all module outputs shall be the same.'
 
     def forward(self, trg_seq,src_seq,valid_mask):
+        """
+        :param trg_seq: B*(L*8)*4, the corners of the L boxes with timestamps
+        :param src_seq: B*(L*T)*128, T point tokens for each of the L frames
+        :param valid_mask: B*(L-1), only used with use_valid_mask
+        :return: B*L*4
+        """
+        B = trg_seq.shape[0]
+        L = trg_seq.shape[1] // 8 # Number of frames, 8 corners per box
+        T = src_seq.shape[1] // L # Number of point tokens per frame
 
         src_seq_=self.proj(src_seq) # Adjust the input features to 128 dimensions
         trg_seq_=self.proj2(trg_seq) # Also adjust Q to 128 dimensions, corresponding to the features of the input box
 
-        enc_output, *_ = self.encoder(src_seq_.reshape(-1,128,self.d_model)) # Locally apply self-attention to every single frame
+        local_seq = src_seq_.reshape(B*L,T,self.d_model)
+        if self.use_valid_mask:
+            frame_valid = torch.cat([valid_mask, torch.ones_like(valid_mask[:, :1])], dim=1) > 0 # B*L
+            token_valid = frame_valid.repeat_interleave(T, dim=1) # B*(L*T)
+            src_mask = token_valid.unsqueeze(1)
+            dec_enc_mask = torch.cat([token_valid, token_valid], dim=1).unsqueeze(1)
+
+            # The tokens of padded frames are never attended to, so their local self-attention is skipped
+            frame_valid = frame_valid.reshape(-1)
+            enc_valid, *_ = self.encoder(local_seq[frame_valid])
+            enc_output = local_seq.new_zeros(local_seq.shape).index_put((frame_valid,), enc_valid)
+        else:
+            src_mask, dec_enc_mask = None, None
+            enc_output, *_ = self.encoder(local_seq) # Locally apply self-attention to every single frame
 
-        enc_others,*_=self.encoder_global(src_seq_, global_feature=True) # Apply attention across frames globally
+        enc_others,*_=self.encoder_global(src_seq_, src_mask, global_feature=True) # Apply attention across frames globally
 
         # Implementing cross-decoder
         # Q: trg_seq_
         # K, V: Concatenate(enc_output, enc_others)
-        enc_output=torch.cat([enc_output.reshape(-1,4*128,self.d_model),enc_others],dim=1) # default 4 frames
-        dec_output, dec_attention,*_ = self.decoder(trg_seq_, None, enc_output, None) 
+        enc_output=torch.cat([enc_output.reshape(B,L*T,self.d_model),enc_others],dim=1)
+        dec_output, dec_attention,*_ = self.decoder(trg_seq_, None, enc_output, dec_enc_mask) 
                                                 
 
         # Project to output
-        dec_output=dec_output.view(dec_output.shape[0],4,self.d_model*8)
+        dec_output=dec_output.view(B,L,self.d_model*8)
         dec_output= self.l1(dec_output)
         dec_output= self.l2(dec_output)
         
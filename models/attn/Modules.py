@@ -5,12 +5,23 @@ import torch.nn.functional as F
 class ScaledDotProductAttention(nn.Module):
     ''' Scaled Dot-Product Attention '''
 
-    def __init__(self, temperature, attn_dropout=0.1):
+    def __init__(self, temperature, attn_dropout=0.1, fused=True):
         super().__init__()
         self.temperature = temperature
         self.dropout = nn.Dropout(attn_dropout)
+        # Use the fused kernel of F.scaled_dot_product_attention, which never materializes the attention map
+        self.fused = fused
 
-    def forward(self, q, k, v, mask=None):
+    def forward(self, q, k, v, mask=None, return_attn=False):
+
+        if self.fused and not return_attn:
+            if q.size(-1) ** 0.5 != self.temperature:
+                # The fused kernel always scales by 1/sqrt(d_k)
+                q = q * (q.size(-1) ** 0.5 / self.temperature)
+            attn_mask = None if mask is None else mask != 0
+            output = F.scaled_dot_product_attention(
+                q, k, v, attn_mask=attn_mask, dropout_p=self.dropout.p if self.training else 0.0)
+            return output, None
 
         attn = torch.matmul(q / self.temperature, k.transpose(2, 3))
 
@@ -7,8 +7,6 @@ Modified by Aron Lin at Jun 2  20:42:22 CST 2023
 import torch
 import torch.nn as nn
 
-from pointnet2.utils.pointnet2_modules import PointnetSAModule
-
 
 class Pointnet_Backbone(nn.Module):
     r"""
@@ -27,6 +25,8 @@ class Pointnet_Backbone(nn.Module):
     """
 
     def __init__(self, use_fps=False, normalize_xyz=False, return_intermediate=False, input_channels=0):
+        # the pointnet2_ops CUDA extension is only loaded by the backbones using it
+        from pointnet2.utils.pointnet2_modules import PointnetSAModule
         super(Pointnet_Backbone, self).__init__()
         self.return_intermediate = return_intermediate
         self.SA_modules = nn.ModuleList()
@@ -91,6 +91,8 @@ class Pointnet_Backbone(nn.Module):
 class ReferedPointnet(nn.Module):
 
     def __init__(self, use_fps=False, normalize_xyz=False, return_intermediate=False, input_channels=0):
+        # the pointnet2_ops CUDA extension is only loaded by the backbones using it
+        from pointnet2.utils.pointnet2_modules import PointnetSAModule
         super(Pointnet_Backbone, self).__init__()
         self.return_intermediate = return_intermediate
         self.SA_modules = nn.ModuleList()
@@ -188,27 +190,66 @@ class MiniPointNet(nn.Module):
         return x
 
 
+class PointTrunk(nn.Module):
+
+    def __init__(self, input_channel, per_point_mlp):
+        """
+        The per-point MLP shared by SegPointNet and FeaturePointNet.
+
+        :param input_channel: int
+        :param per_point_mlp: list
+        """
+        super(PointTrunk, self).__init__()
+        self.seq_per_point = nn.ModuleList()
+        in_channel = input_channel
+        for out_channel in per_point_mlp:
+            self.seq_per_point.append(
+                nn.Sequential(
+                    nn.Conv1d(in_channel, out_channel, 1),
+                    nn.BatchNorm1d(out_channel),
+                    nn.ReLU()
+                ))
+            in_channel = out_channel
+
+    def forward(self, x):
+        """
+
+        :param x: B,C,N
+        :return: (B,per_point_mlp[1],N), (B,per_point_mlp[-1],N)
+        """
+        second_layer_out = None
+        for i, mlp in enumerate(self.seq_per_point):
+            x = mlp(x)
+            if i == 1:
+                second_layer_out = x
+        return second_layer_out, x
+
+
 class SegPointNet(nn.Module):
 
-    def __init__(self, input_channel, per_point_mlp1, per_point_mlp2, output_size=0, return_intermediate=False):
+    def __init__(self, input_channel, per_point_mlp1, per_point_mlp2, output_size=0, return_intermediate=False,
+                 with_trunk=True):
         """
 
         :param input_channel: int
         :param per_point_mlp: list
         :param hidden_mlp: list
         :param output_size: int, if output_size <=0, then the final fc will not be used
+        :param with_trunk: bool, if False, the per-point MLP is not built and forward_head
+                           takes the outputs of a shared PointTrunk
         """
         super(SegPointNet, self).__init__()
         self.return_intermediate = return_intermediate
         self.seq_per_point = nn.ModuleList()
         in_channel = input_channel
         for out_channel in per_point_mlp1:
-            self.seq_per_point.append(
-                nn.Sequential(
-                    nn.Conv1d(in_channel, out_channel, 1), #nn.Conv1d的输入应当是一个3D的张量，[batch_size, in_channels, input_length]
-                    nn.BatchNorm1d(out_channel),
-                    nn.ReLU()
-                ))
+            if with_trunk:
+                self.seq_per_point.append(
+                    nn.Sequential(
+                        nn.Conv1d(in_channel, out_channel, 1), #nn.Conv1d的输入应当是一个3D的张量，[batch_size, in_channels, input_length]
+                        nn.BatchNorm1d(out_channel),
+                        nn.ReLU()
+                    ))
             in_channel = out_channel
 
         self.pool = nn.AdaptiveMaxPool1d(output_size=1)
@@ -239,6 +280,15 @@ class SegPointNet(nn.Module):
             x = mlp(x)
             if i == 1:
                 second_layer_out = x
+        return self.forward_head(second_layer_out, x)
+
+    def forward_head(self, second_layer_out, x):
+        """
+
+        :param second_layer_out: B,per_point_mlp1[1],N
+        :param x: B,per_point_mlp1[-1],N
+        :return: B,output_size,N
+        """
         pooled_feature = self.pool(x)  # B,C,1
         pooled_feature_expand = pooled_feature.expand_as(x)
         x = torch.cat([second_layer_out, pooled_feature_expand], dim=1)
@@ -252,21 +302,27 @@ class SegPointNet(nn.Module):
     
 class FeaturePointNet(nn.Module):
 
-    def __init__(self, input_channel, per_point_mlp1, per_point_mlp2, output_size=0, return_intermediate=False):
+    def __init__(self, input_channel, per_point_mlp1, per_point_mlp2, output_size=0, return_intermediate=False,
+                 with_trunk=True, num_tokens=None):
+        """
+
+        :param num_tokens: int, number of pooled points per cloud, defaults to output_size
+        """
         super(FeaturePointNet, self).__init__()
         self.return_intermediate = return_intermediate
         self.seq_per_point = nn.ModuleList()
         in_channel = input_channel
         for out_channel in per_point_mlp1:
-            self.seq_per_point.append(
-                nn.Sequential(
-                    nn.Conv1d(in_channel, out_channel, 1), 
-                    nn.BatchNorm1d(out_channel),
-                    nn.ReLU()
-                ))
+            if with_trunk:
+                self.seq_per_point.append(
+                    nn.Sequential(
+                        nn.Conv1d(in_channel, out_channel, 1), 
+                        nn.BatchNorm1d(out_channel),
+                        nn.ReLU()
+                    ))
             in_channel = out_channel
 
-        self.pre_pool = nn.AdaptiveMaxPool1d(output_size=output_size) 
+        self.pre_pool = nn.AdaptiveMaxPool1d(output_size=num_tokens if num_tokens is not None else output_size) 
         self.pool = nn.AdaptiveMaxPool1d(output_size=1) 
         
 
@@ -296,6 +352,15 @@ class FeaturePointNet(nn.Module):
             x = mlp(x)
             if i == 1:
                 second_layer_out = x
+        return self.forward_head(second_layer_out, x)
+
+    def forward_head(self, second_layer_out, x):
+        """
+
+        :param second_layer_out: B,per_point_mlp1[1],N
+        :param x: B,per_point_mlp1[-1],N
+        :return: B,output_size,N
+        """
         pooled_feature = self.pool(x)  
         pre_pooled_feature = self.pre_pool(second_layer_out) # Pool to a fixed size
 
@@ -9,18 +9,27 @@ import torch.nn as nn
 from easydict import EasyDict
 import pytorch_lightning as pl
 from datasets import points_utils
-from utils.metrics import TorchSuccess, TorchPrecision, AverageMeter, TorchRuntime, TorchNumFrames
-from utils.metrics import estimateOverlap, estimateAccuracy
-from utils.waymo_metrics import estimateWaymoOverlap # only for waymo IOU
+from datasets.searchspace import KalmanFiltering
+from datasets.sampler import DATA_STAGES, FRAME_CACHE_COUNTERS
+from datasets.frame_stream import FrameStream, PreparedFrames, tracklet_boxes
+from utils.metrics import TorchStreamingSuccess, TorchStreamingPrecision, AverageMeter, TorchRuntime, TorchNumFrames
+from utils.metrics import TorchDataStats, TorchLatency
+from utils.timing import StageTimer, NULL_TIMER
+from utils.metrics import estimateOverlapBatch, estimateAccuracyBatch
+from utils.tracking_results import save_tracking_results
 import torch.nn.functional as F
 import numpy as np
-from nuscenes.utils import geometry_utils
 
 from datasets.misc_utils import get_history_frame_ids_and_masks,get_last_n_bounding_boxes
 from datasets.misc_utils import generate_timestamp_prev_list
 
+import copy
+import os
 import time
 
+# Stages of tracking a frame timed by evaluate_one_sequence
+LATENCY_STAGES = ('build', 'h2d', 'forward', 'decode', 'metric')
+
 class BaseModelMF(pl.LightningModule):
     def __init__(self, config=None, **kwargs):
         super().__init__()
@@ -30,15 +39,36 @@ class BaseModelMF(pl.LightningModule):
         self.train_dataloader_length = kwargs.get('train_dataloader_length', None)
 
         # testing metrics
-        self.prec = TorchPrecision()
-        self.success = TorchSuccess()
+        self.prec = TorchStreamingPrecision()
+        self.success = TorchStreamingSuccess()
         self.runtime = TorchRuntime()
 
-        self.prec_step = TorchPrecision()
-        self.success_step = TorchSuccess()
+        self.prec_step = TorchStreamingPrecision()
+        self.success_step = TorchStreamingSuccess()
 
         self.n_frames = TorchNumFrames()
 
+        # Multi-hypothesis inference: number of reference boxes tracked per frame, their offsets (x, y, angle)
+        # are drawn from a gaussian with the hypothesis_bnd variances, the best box is selected or the centers fused
+        self.num_hypotheses = getattr(config, 'num_hypotheses', 1)
+        self.hypothesis_fusion = getattr(config, 'hypothesis_fusion', 'select')
+        self.hypothesis_space = KalmanFiltering(bnd=getattr(config, 'hypothesis_bnd', [0.09, 0.09, 0.0076]))
+
+        # (tracklet_id, gt boxes, predicted boxes) of the test tracklets, saved at the end of testing
+        self.save_results = getattr(config, 'save_results', False)
+        self.tracking_results = []
+
+        # Per-sample time of the training data pipeline stages and frame cache counters, collected from the
+        # 'data_stats' of the batches
+        self.data_stats = TorchDataStats(len(DATA_STAGES) + 1 + len(FRAME_CACHE_COUNTERS))
+        # Per-frame time of the tracking stages, reported as percentiles
+        self.latency = TorchLatency(len(LATENCY_STAGES))
+        # Prepare the next frames of a tracklet (index of their points for the crops) with a thread, while the
+        # current frame is tracked
+        self.pipeline_tracking = getattr(config, 'pipeline_tracking', False)
+        # Tracklets, frames and tracking seconds of this rank, and the start of the evaluation, see log_rank_summary
+        self.eval_tracklets, self.eval_frames, self.eval_seconds, self.eval_start = 0, 0, 0., None
+
 
     def configure_optimizers(self):
         if self.config.optimizer.lower() == 'sgd':
@@ -65,6 +95,56 @@ class BaseModelMF(pl.LightningModule):
         else:
             raise ValueError("Invalid optimizer. Please choose from 'sgd', 'adam', or 'adamonecycle'.")
 
+    def on_train_epoch_start(self):
+        # Streaming datasets (datasets.shards) pick their shards and shuffle them by epoch, and so do the chunked
+        # batch samplers (datasets.chunk_sampler)
+        for source in (getattr(self.trainer.train_dataloader, 'dataset', None),
+                       getattr(self.trainer.train_dataloader, 'batch_sampler', None)):
+            if callable(getattr(source, 'set_epoch', None)):
+                source.set_epoch(self.current_epoch)
+
+    def on_train_batch_start(self, batch, batch_idx):
+        if 'data_stats' in batch:
+            self.data_stats.update(batch['data_stats'])
+
+    def on_train_epoch_end(self):
+        self.log_data_stats()
+
+    def log_data_stats(self):
+        """
+        Logs the mean time per sample of each stage of the data pipeline (profile_data_pipeline), summed over
+        the data loading workers of all the ranks, and prints it as a table. Also logs the hits, misses and
+        evictions per sample of the frame caches of the workers (frame_cache_mb).
+        """
+        if self.data_stats.num_samples == 0:
+            return
+        stats = self.data_stats.compute().cpu().numpy()
+        self.data_stats.reset()
+        timings, rejected, counters = np.split(stats, [len(DATA_STAGES), len(DATA_STAGES) + 1])
+        cache = dict(zip(FRAME_CACHE_COUNTERS, counters))
+        if cache['hits'] + cache['misses'] > 0:
+            self.logger.experiment.add_scalars('data_pipeline/frame_cache_per_sample', cache,
+                                               global_step=self.global_step)
+            hit_rate = cache['hits'] / (cache['hits'] + cache['misses'])
+            self.logger.experiment.add_scalar('data_pipeline/frame_cache_hit_rate', hit_rate,
+                                              global_step=self.global_step)
+            if self.trainer.is_global_zero:
+                print(f"frame cache, epoch {self.current_epoch}: hit rate {hit_rate:.3f}, "
+                      f"{cache['misses']:.2f} reads and {cache['evictions']:.2f} evictions per sample")
+        if timings.sum() == 0:  # frame cache counters only
+            return
+        ms = {stage: ns / 1e6 for stage, ns in zip(DATA_STAGES, timings)}
+        self.logger.experiment.add_scalars('data_pipeline/ms_per_sample', ms, global_step=self.global_step)
+        self.logger.experiment.add_scalar('data_pipeline/rejected_per_sample', rejected[0], global_step=self.global_step)
+
+        if self.trainer.is_global_zero:
+            total = sum(ms.values())
+            print(f'data pipeline, epoch {self.current_epoch}: {total:.2f} ms and {rejected[0]:.3f} rejected per sample')
+            print('| stage | ms per sample | share |')
+            print('|---|---|---|')
+            for stage, t in ms.items():
+                print(f'| {stage} | {t:.3f} | {100 * t / max(total, 1e-9):.1f}% |')
+
 
 
     def compute_loss(self, data, output):
@@ -73,8 +153,18 @@ class BaseModelMF(pl.LightningModule):
     def build_input_dict(self, sequence, frame_id, results_bbs, **kwargs):
         raise NotImplementedError
 
-    def evaluate_one_sample(self, data_dict, ref_box):
+    def to_device(self, data_dict):
+        return {k: v.to(self.device, non_blocking=True) for k, v in data_dict.items()}
+
+    def synchronize(self):
+        # Waits for the queued cuda kernels, so that the stage timings do not leak into each other
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def evaluate_one_sample(self, data_dict, ref_box, timer=NULL_TIMER):
         end_points = self(data_dict)
+        self.synchronize()
+        timer.lap('forward')
 
         estimation_box = end_points['aux_estimation_boxes']
         estimation_box_cpu = estimation_box.squeeze(0).detach().cpu().numpy()
@@ -88,57 +178,169 @@ class BaseModelMF(pl.LightningModule):
         candidate_box = points_utils.getOffsetBB(ref_box, estimation_box_cpu, degrees=self.config.degrees,
                                                  use_z=self.config.use_z,
                                                  limit_box=self.config.limit_box)
+        timer.lap('decode')
 
         return candidate_box,valid_mask
 
+    def evaluate_hypotheses(self, sequence, frame_id, results_bbs, timer=NULL_TIMER):
+        """
+        Track one frame from num_hypotheses reference boxes: the previous estimate and offsets of it drawn
+        from the hypothesis search space. All hypotheses run as one batch, and the resulting boxes are
+        selected or fused by the foreground score of the current frame points.
+        :return: the estimated box
+        """
+        ref_bb = results_bbs[-1]
+        self.hypothesis_space.reset()
+        offsets = np.concatenate([np.zeros((1, 3)), self.hypothesis_space.sample(self.num_hypotheses - 1)])
+        ref_bbs = [points_utils.getOffsetBB(ref_bb, offset, degrees=self.config.degrees, limit_box=False)
+                   for offset in offsets]
+        data_dicts = [self.build_input_dict(sequence, frame_id, results_bbs[:-1] + [bb])[0] for bb in ref_bbs]
+        data_dict = {k: torch.cat([d[k] for d in data_dicts], dim=0) for k in data_dicts[0]}
+        timer.lap('build')
+        data_dict = self.to_device(data_dict)
+        self.synchronize()
+        timer.lap('h2d')
+
+        non_empty = (torch.sum(data_dict['points'][:, :, :3], dim=(1, 2)) != 0).cpu().numpy()
+        if not non_empty.any():
+            print("Empty pointcloud!")
+            timer.skip('forward', 'decode')
+            return ref_bb
+
+        end_points = self(data_dict)
+        self.synchronize()
+        timer.lap('forward')
+        estimation_boxes = end_points['aux_estimation_boxes'].detach().cpu().numpy()
+        # Mean foreground probability of the current frame points
+        seg_probs = F.softmax(end_points['seg_logits'][:, :, -self.config.point_sample_size:], dim=1)
+        scores = seg_probs[:, 1].mean(dim=1).detach().cpu().numpy()
+        scores = np.where(non_empty, scores, -np.inf)
+
+        candidate_boxes = [points_utils.getOffsetBB(bb, estimation_box, degrees=self.config.degrees,
+                                                    use_z=self.config.use_z, limit_box=self.config.limit_box)
+                           for bb, estimation_box in zip(ref_bbs, estimation_boxes)]
+        best_box = candidate_boxes[int(np.argmax(scores))]
+        if self.hypothesis_fusion == 'mean':
+            weights = np.where(non_empty, scores, 0)
+            if weights.sum() <= 0:
+                # no foreground anywhere: the non-empty hypotheses weigh the same
+                weights = non_empty.astype(float)
+            weights = weights / weights.sum()
+            best_box = copy.deepcopy(best_box)
+            best_box.center = np.sum([w * box.center for w, box in zip(weights, candidate_boxes)], axis=0)
+        timer.lap('decode')
+        return best_box
+
+    def prepare_frame(self, frame):
+        return dict(frame, x_index=points_utils.build_x_index(frame['pc']))
+
+    def pipeline(self, sequence):
+        """
+        :return: the sequence, with its frames prepared by a thread ahead of the tracker (prepare_frame)
+        """
+        if isinstance(sequence, FrameStream):
+            sequence.prepare = self.prepare_frame
+            return sequence
+        return PreparedFrames(sequence, prefetch=getattr(self.config, 'stream_prefetch', 4),
+                              history=getattr(self.config, 'hist_num', 1), prepare=self.prepare_frame)
+
+    def search_area_points(self, frame, box):
+        """
+        :return: the points of the frame to crop the search area of box from, the candidates of its x index when
+            the frame was prepared
+        """
+        if 'x_index' not in frame:
+            return frame['pc']
+        return points_utils.crop_candidates(frame['pc'], frame['x_index'], box, scale=self.config.bb_scale,
+                                            offset=self.config.bb_offset)
+
     def evaluate_one_sequence(self, sequence):
         """
         :param sequence: a sequence of annos {"pc": pc, "3d_bbox": bb, 'meta': anno}
-        :return:
+        :return: ious, distances, the predicted boxes and the nanoseconds of the LATENCY_STAGES of each tracked
+            frame <N-1, len(LATENCY_STAGES)>. The metric time of the sequence is split evenly between its frames.
         """
-        ious = []
-        distances = []
-
+        if self.pipeline_tracking:
+            sequence = self.pipeline(sequence)
         results_bbs = []
-        for frame_id in range(len(sequence)):  # tracklet
-            if frame_id == 0:
-                # the first frame
-                this_bb = sequence[frame_id]["3d_bbox"]
-                prev_bb = sequence[frame_id]["3d_bbox"]
-                results_bbs.append(this_bb)
-                new_refboxs = [prev_bb] # Update in special cases
-            else:
-                this_bb = sequence[frame_id]["3d_bbox"]
-
-                # construct input dict
-                data_dict, ref_bb = self.build_input_dict(sequence, frame_id, results_bbs)
-                # run the tracker
-                if torch.sum(data_dict['points'][:,:,:3]) == 0:
-                    results_bbs.append(ref_bb)
-                    print("Empty pointcloud!")
-                    new_refboxs = [ref_bb]
+        gt_bbs = []
+        timer = StageTimer(LATENCY_STAGES)
+        latencies = []
+        try:
+            for frame_id in range(len(sequence)):  # tracklet
+                if frame_id == 0:
+                    # the first frame
+                    this_bb = sequence[frame_id]["3d_bbox"]
+                    prev_bb = sequence[frame_id]["3d_bbox"]
+                    results_bbs.append(this_bb)
+                    new_refboxs = [prev_bb] # Update in special cases
                 else:
-                    candidate_box,*_ = self.evaluate_one_sample(data_dict, ref_box=ref_bb)
-                    results_bbs.append(candidate_box)
-
-            
-            this_overlap = estimateOverlap(this_bb, results_bbs[-1], dim=self.config.IoU_space,
-                                           up_axis=self.config.up_axis)
-
-            this_accuracy = estimateAccuracy(this_bb, results_bbs[-1], dim=self.config.IoU_space,
-                                             up_axis=self.config.up_axis)
-            ious.append(this_overlap)
-            distances.append(this_accuracy)
-
-        return ious, distances, results_bbs
+                    this_bb = sequence[frame_id]["3d_bbox"]
+                    timer.reset()
+                    timer.start()
+
+                    if self.num_hypotheses > 1:
+                        results_bbs.append(self.evaluate_hypotheses(sequence, frame_id, results_bbs, timer=timer))
+                        latencies.append(timer.ns.copy())
+                        gt_bbs.append(this_bb)
+                        continue
+
+                    # construct input dict
+                    data_dict, ref_bb = self.build_input_dict(sequence, frame_id, results_bbs)
+                    timer.lap('build')
+                    data_dict = self.to_device(data_dict)
+                    self.synchronize()
+                    timer.lap('h2d')
+                    # run the tracker
+                    if torch.sum(data_dict['points'][:,:,:3]) == 0:
+                        results_bbs.append(ref_bb)
+                        print("Empty pointcloud!")
+                        timer.skip('forward', 'decode')
+                        new_refboxs = [ref_bb]
+                    else:
+                        candidate_box,*_ = self.evaluate_one_sample(data_dict, ref_box=ref_bb, timer=timer)
+                        results_bbs.append(candidate_box)
+                    latencies.append(timer.ns.copy())
+
+                gt_bbs.append(this_bb)
+
+            # Score the whole tracklet at once
+            timer.reset()
+            timer.start()
+            ious = estimateOverlapBatch(gt_bbs, results_bbs, dim=self.config.IoU_space,
+                                        up_axis=self.config.up_axis).tolist()
+            distances = estimateAccuracyBatch(gt_bbs, results_bbs, dim=self.config.IoU_space,
+                                              up_axis=self.config.up_axis).tolist()
+            timer.lap('metric')
+        finally:
+            # stops the reading thread and releases the frames, also when tracking fails, the boxes are kept
+            if isinstance(sequence, FrameStream):
+                sequence.close()
+
+        latencies = np.array(latencies, dtype=np.int64).reshape(-1, len(LATENCY_STAGES))
+        if len(latencies) > 0:
+            latencies[:, LATENCY_STAGES.index('metric')] = timer.ns[LATENCY_STAGES.index('metric')] // len(latencies)
+        return ious, distances, results_bbs, latencies
+
+    def padding_step(self):
+        """
+        Step of an empty tracklet padding the ranks to the same number of steps (TrackletDistributedSampler):
+        nothing is tracked, the epoch metrics are still logged for all the ranks to synchronize them
+        """
+        self.log('success/test', self.success, on_epoch=True)
+        self.log('precision/test', self.prec, on_epoch=True)
 
     def validation_step(self, batch, batch_idx):
         sequence = batch[0]  # unwrap the batch with batch size = 1
+        if len(sequence) == 0:
+            return self.padding_step()
         start_time = time.time()
-        ious, distances, *_ = self.evaluate_one_sequence(sequence)
+        ious, distances, _, latencies = self.evaluate_one_sequence(sequence)
         end_time = time.time()
-        runtime = end_time-start_time
+        # The runtime of the tracker, without the metric computation
+        runtime = end_time-start_time - latencies[:, LATENCY_STAGES.index('metric')].sum() / 1e9
         n_frames = len(sequence)
+        self.latency(torch.tensor(latencies, device=self.device))
 
         self.success(torch.tensor(ious, device=self.device))
         self.prec(torch.tensor(distances, device=self.device))
@@ -154,9 +356,16 @@ class BaseModelMF(pl.LightningModule):
         self.runtime(torch.tensor(runtime, device=self.device),
                      torch.tensor(n_frames, device=self.device))
 
+        self.eval_tracklets += 1
+        self.eval_frames += n_frames
+        self.eval_seconds += runtime
+
         self.success_step.reset()
         self.prec_step.reset()
 
+    def on_validation_epoch_start(self):
+        self.start_rank_summary()
+
     def on_validation_epoch_end(self):
         self.logger.experiment.add_scalars('metrics/test',
                                     {'success': self.success.compute(),
@@ -166,15 +375,23 @@ class BaseModelMF(pl.LightningModule):
         self.logger.experiment.add_scalars('runtime',
                                        {'runtime':1.0/self.runtime.compute()},
                                        global_step=self.global_step)
+        self.log_latency()
+        self.log_rank_summary()
 
+    def on_test_epoch_start(self):
+        self.start_rank_summary()
 
     def test_step(self, batch, batch_idx):
         sequence = batch[0]  # unwrap the batch with batch size = 1
+        if len(sequence) == 0:
+            return self.padding_step()
         start_time = time.time()
-        ious, distances, result_bbs, *_= self.evaluate_one_sequence(sequence)
+        ious, distances, result_bbs, latencies = self.evaluate_one_sequence(sequence)
         end_time = time.time()
-        runtime = end_time-start_time
+        # The runtime of the tracker, without the metric computation
+        runtime = end_time-start_time - latencies[:, LATENCY_STAGES.index('metric')].sum() / 1e9
         n_frames = len(sequence)
+        self.latency(torch.tensor(latencies, device=self.device))
 
         
         self.success(torch.tensor(ious, device=self.device))
@@ -195,7 +412,17 @@ class BaseModelMF(pl.LightningModule):
 
         self.runtime(torch.tensor(runtime, device=self.device),
                      torch.tensor(n_frames, device=self.device))
-        self.logger.experiment.add_scalars('FPS', {'fps': 1.0/self.runtime.compute()}, global_step=batch_idx)
+        self.eval_tracklets += 1
+        self.eval_frames += n_frames
+        self.eval_seconds += runtime
+        # frames per second of this rank so far: runtime.compute() would synchronize the ranks at every step
+        self.logger.experiment.add_scalars('FPS', {'fps': self.eval_frames / max(self.eval_seconds, 1e-9)},
+                                           global_step=batch_idx)
+
+        if self.save_results:
+            # the first frames of a FrameStream are released while tracking
+            tracklet_id = sequence.tracklet_id if isinstance(sequence, FrameStream) else sequence[0]['tracklet_id']
+            self.tracking_results.append((tracklet_id, tracklet_boxes(sequence), result_bbs))
 
         return result_bbs
 
@@ -212,6 +439,69 @@ class BaseModelMF(pl.LightningModule):
                                     {'frame':self.n_frames.compute(),},
                                     global_step=self.global_step)
 
+        if self.save_results and len(self.tracking_results) > 0:
+            file_name = os.path.join(self.trainer.log_dir or '.', 'tracking_results',
+                                     f'rank{self.global_rank}.npz')
+            save_tracking_results(file_name, self.tracking_results, checkpoint=getattr(self.config, 'checkpoint', None))
+            self.tracking_results = []
+        self.log_latency(print_table=True)
+        self.log_rank_summary(print_table=True)
+
+    def log_latency(self, print_table=False):
+        """
+        Logs the p50/p95/p99 milliseconds per frame of each stage of the tracker and of their total
+        (without the metric computation), over the frames that ran the stage, and resets the latencies
+        """
+        percentiles = (50, 95, 99)
+        # compute gathers the histograms of all the ranks, every rank calls it
+        quantiles = self.latency.compute(percentiles).cpu().numpy() / 1e6
+        frames = self.latency.frames_per_stage().cpu().numpy()
+        self.latency.reset()
+        if frames[0] == 0:
+            return
+        # the frames without points skip the model, their forward and decode stages are not counted
+        stages = LATENCY_STAGES + ('total',)
+        for p, q in zip(percentiles, quantiles):
+            measured = {stage: v for stage, v, n in zip(stages, q, frames) if n > 0}
+            self.logger.experiment.add_scalars(f'latency_ms/p{p}', measured, global_step=self.global_step)
+        self.logger.experiment.add_scalar('latency/frames_skipping_the_model',
+                                          frames[0] - frames[LATENCY_STAGES.index('forward')],
+                                          global_step=self.global_step)
+
+        if print_table and self.trainer.is_global_zero:
+            print('| stage | frames | ' + ' | '.join(f'p{p} (ms)' for p in percentiles) + ' |')
+            print('|---|---|' + '---|' * len(percentiles))
+            for i, stage in enumerate(stages):
+                print(f'| {stage} | {frames[i]} | ' + ' | '.join(f'{q[i]:.2f}' for q in quantiles) + ' |')
+
+    def start_rank_summary(self):
+        self.eval_tracklets, self.eval_frames, self.eval_seconds, self.eval_start = 0, 0, 0., time.time()
+
+    def log_rank_summary(self, print_table=False):
+        """
+        Logs the tracklets, frames and wall time of each rank during the evaluation: the slowest rank bounds the
+        evaluation time (see datasets.sampler.TrackletDistributedSampler)
+        """
+        if self.eval_start is None:
+            return
+        stats = torch.tensor([self.eval_tracklets, self.eval_frames, time.time() - self.eval_start],
+                             dtype=torch.float64, device=self.device)
+        stats = self.all_gather(stats).reshape(-1, 3).cpu().numpy()
+        self.eval_start = None
+        self.logger.experiment.add_scalars('ranks/seconds', {f'rank{r}': s for r, s in enumerate(stats[:, 2])},
+                                           global_step=self.global_step)
+        self.logger.experiment.add_scalars('ranks/frames', {f'rank{r}': f for r, f in enumerate(stats[:, 1])},
+                                           global_step=self.global_step)
+
+        if print_table and self.trainer.is_global_zero:
+            print(f'evaluation time: {stats[:, 2].max():.1f} s, '
+                  f'slowest rank / mean: {stats[:, 2].max() / max(stats[:, 2].mean(), 1e-9):.2f}')
+            print('| rank | tracklets | frames | seconds | frames per second |')
+            print('|---|---|---|---|---|')
+            for r, (tracklets, frames, seconds) in enumerate(stats):
+                print(f'| {r} | {tracklets:.0f} | {frames:.0f} | {seconds:.1f} | {frames / max(seconds, 1e-9):.1f} |')
+
+
 class MotionBaseModelMF(BaseModelMF):
     def __init__(self, config, **kwargs):
         super().__init__(config, **kwargs)
@@ -223,10 +513,10 @@ class MotionBaseModelMF(BaseModelMF):
         prev_frame_ids, valid_mask = get_history_frame_ids_and_masks(frame_id,self.hist_num)
         prev_frames = [sequence[id] for id in prev_frame_ids]
         this_frame = sequence[frame_id]
-        this_pc = this_frame['pc']
         bbox_size = this_frame['3d_bbox'].wlh
-        prev_pcs = [frame['pc'] for frame in prev_frames]
         ref_boxs = get_last_n_bounding_boxes(results_bbs,valid_mask)
+        this_pc = self.search_area_points(this_frame, ref_boxs[0])
+        prev_pcs = [self.search_area_points(frame, ref_box) for frame, ref_box in zip(prev_frames, ref_boxs)]
         num_hist = len(valid_mask)
 
         prev_frame_pcs = []
@@ -250,7 +540,7 @@ class MotionBaseModelMF(BaseModelMF):
         this_points, idx_this = points_utils.regularize_pc(this_frame_pc.points.T,
                                                            self.config.point_sample_size,
                                                            seed=1) 
-        seg_mask_prev_list = [geometry_utils.points_in_box(ref_box, prev_points.T[:3,:], 1.25).astype(float) for ref_box,prev_points in zip(ref_boxs,prev_points_list)]#应当只考虑xyz特征
+        seg_mask_prev_list = [points_utils.points_in_box(ref_box, prev_points.T[:3,:], 1.25).astype(float) for ref_box,prev_points in zip(ref_boxs,prev_points_list)]#应当只考虑xyz特征
 
         # Here we use 0.2/0.8 instead of 0/1 to indicate that the previous box is not GT.
         # When boxcloud is used, the actual value of prior-targetness mask doesn't really matter.
@@ -288,10 +578,11 @@ class MotionBaseModelMF(BaseModelMF):
         ]
         ref_boxs_np = np.stack(ref_box_list, axis=0)
 
-        data_dict = {"points": torch.tensor(stack_points[None, :], device=self.device, dtype=torch.float32), 
-                     "ref_boxs":torch.tensor(ref_boxs_np[None, :], device=self.device, dtype=torch.float32), 
-                     "valid_mask":torch.tensor(valid_mask, device=self.device, dtype=torch.float32).unsqueeze(0), 
-                     "bbox_size":torch.tensor(bbox_size[None, :],device=self.device, dtype=torch.float32),
+        # The inputs are built on the cpu, evaluate_one_sequence moves them to the device
+        data_dict = {"points": torch.tensor(stack_points[None, :], dtype=torch.float32), 
+                     "ref_boxs":torch.tensor(ref_boxs_np[None, :], dtype=torch.float32), 
+                     "valid_mask":torch.tensor(valid_mask, dtype=torch.float32).unsqueeze(0), 
+                     "bbox_size":torch.tensor(bbox_size[None, :], dtype=torch.float32),
                      }
 
         if getattr(self.config, 'box_aware', False):
@@ -305,6 +596,5 @@ class MotionBaseModelMF(BaseModelMF):
             candidate_bc_prev_list = candidate_bc_prev_list + [candidate_bc_this]
             candidate_bc = np.concatenate(candidate_bc_prev_list, axis=0)
 
-            data_dict.update({'candidate_bc': points_utils.np_to_torch_tensor(candidate_bc.astype('float32'),
-                                                                              device=self.device)})
+            data_dict.update({'candidate_bc': points_utils.np_to_torch_tensor(candidate_bc.astype('float32'))})
         return data_dict, results_bbs[-1]
\ No newline at end of file
@@ -1,13 +1,13 @@
 from datasets import points_utils
 from models import base_model
-from models.backbone.pointnet import MiniPointNet, SegPointNet, FeaturePointNet
+from models.backbone.pointnet import MiniPointNet, SegPointNet, FeaturePointNet, PointTrunk
 from models.attn.Models import Seq2SeqFormer
 
 import torch
 from torch import nn
 import torch.nn.functional as F
 
-from torchmetrics import Accuracy
+from torchmetrics import Accuracy, MeanMetric
 
 from datasets.misc_utils import get_tensor_corners_batch
 from datasets.misc_utils import create_corner_timestamps
@@ -18,14 +18,26 @@ class SEQTRACK3D(base_model.MotionBaseModelMF):
     def __init__(self, config, **kwargs):
         super().__init__(config, **kwargs)
         self.hist_num = getattr(config, 'hist_num', 1)
+        self.feature_tokens = getattr(config, 'feature_tokens', 128) # Number of point tokens per frame
         self.seg_acc = Accuracy(task='multiclass',num_classes=2, average='none')
 
         self.box_aware = getattr(config, 'box_aware', False)
         self.use_motion_cls = getattr(config, 'use_motion_cls', True)
+        # Run the per-point MLP once and feed both the segmentation and the feature head
+        self.shared_trunk = getattr(config, 'shared_trunk', False)
+        # Skip padded history frames: mask them in the transformer and do not recompute them at inference
+        self.skip_padded_frames = getattr(config, 'skip_padded_frames', False)
+        # Static probability above which inference returns the 1st stage box, None to always refine
+        self.early_exit_threshold = getattr(config, 'early_exit_threshold', None)
+        self.early_exit_ratio = MeanMetric()
+        if self.shared_trunk:
+            self.point_trunk = PointTrunk(input_channel=3 + 1 + 1 + (9 if self.box_aware else 0),
+                                          per_point_mlp=[64, 64, 64, 128, 1024])
         self.seg_pointnet = SegPointNet(input_channel=3 + 1 + 1 + (9 if self.box_aware else 0),
                                         per_point_mlp1=[64, 64, 64, 128, 1024],
                                         per_point_mlp2=[512, 256, 128, 128],
-                                        output_size=2 + (9 if self.box_aware else 0))
+                                        output_size=2 + (9 if self.box_aware else 0),
+                                        with_trunk=not self.shared_trunk)
         self.mini_pointnet = MiniPointNet(input_channel=3 + 1 + (9 if self.box_aware else 0),
                                           per_point_mlp=[64, 128, 256, 512],
                                           hidden_mlp=[512, 256],
@@ -53,10 +65,13 @@ class SEQTRACK3D(base_model.MotionBaseModelMF):
             input_channel=3 + 1 + 1 + (9 if self.box_aware else 0),
             per_point_mlp1=[64, 64, 64, 128, 1024],
             per_point_mlp2=[512, 256, 128, 128],
-            output_size=128)
+            output_size=128,
+            with_trunk=not self.shared_trunk,
+            num_tokens=self.feature_tokens)
 
         self.Transformer = Seq2SeqFormer(d_word_vec=64, d_model=64, d_inner=512,
-            n_layers=3, n_head=4, d_k=64, d_v=64, n_position = 1024*4)
+            n_layers=3, n_head=4, d_k=64, d_v=64, n_position = (self.hist_num + 1) * self.feature_tokens,
+            use_valid_mask=self.skip_padded_frames)
 
 
     def forward(self, input_dict):
@@ -95,15 +110,37 @@ class SEQTRACK3D(base_model.MotionBaseModelMF):
         L = HL + 1 # Total length of the point cloud sequence, 1 represents the current frame
         chunk_size = N // L
 
-        seg_out = self.seg_pointnet(x) 
-        seg_logits = seg_out[:, :2, :]  # B,2,N
-        pred_cls = torch.argmax(seg_logits, dim=1, keepdim=True)  # B,1,N
+        # Padded history frames repeat the oldest valid one. At inference, seg_pointnet (and the feature head of the
+        # shared trunk) only run on the frames that are valid for some sample, and the padded frames read the outputs
+        # of the frame they repeat. feature_pointnet without the shared trunk still runs on every frame, its input
+        # reshape mixes the frames. The outputs match those without skipping only when the padded frames are exact
+        # copies: the test samples resample the points of every frame (regularize_pc), so they usually are not.
+        frame_index = None
+        if self.skip_padded_frames and not self.training:
+            valid_mask = input_dict["valid_mask"]
+            frame_valid = torch.cat([valid_mask, torch.ones_like(valid_mask[:, :1])], dim=1) > 0 # B*L
+            if not frame_valid.all():
+                keep, frame_index = self.padded_frame_index(frame_valid)
+                x = x.reshape(B, -1, L, chunk_size)[:, :, keep].reshape(B, -1, int(keep.sum()) * chunk_size)
+        L_in = x.shape[2] // chunk_size # Number of frames fed to the point networks
+
+        if self.shared_trunk:
+            second_layer_out, trunk_out = self.point_trunk(x)
+            seg_out = self.seg_pointnet.forward_head(second_layer_out, trunk_out)
+        else:
+            seg_out = self.seg_pointnet(x) 
+        pred_cls = torch.argmax(seg_out[:, :2, :], dim=1, keepdim=True)  # B,1,N
         mask_points = x[:, :4, :] * pred_cls 
 
         if self.box_aware:
-            pred_bc = seg_out[:, 2:, :]
-            mask_pred_bc = pred_bc * pred_cls
+            mask_pred_bc = seg_out[:, 2:, :] * pred_cls
             mask_points = torch.cat([mask_points, mask_pred_bc], dim=1)
+
+        if frame_index is not None:
+            seg_out = self.gather_frames(seg_out, frame_index, chunk_size)
+        seg_logits = seg_out[:, :2, :]  # B,2,N
+        if self.box_aware:
+            pred_bc = seg_out[:, 2:, :]
             output_dict['pred_bc'] = pred_bc.transpose(1, 2)
 
         # Coarse initial motion prediction
@@ -138,16 +175,53 @@ class SEQTRACK3D(base_model.MotionBaseModelMF):
         corner_stamps = create_corner_timestamps(B,HL,8).to(self.device)
         box_seq_corners = torch.cat((box_seq_corners,corner_stamps),dim=-1) # B*(L*8)*4 where 4 represents features for x, y, z, and timestamp
 
-        solo_x = x.reshape(B*L,-1,chunk_size) # Reshape into separate point clouds
-        feature = self.feature_pointnet(solo_x) #(B*num) * C * N Note: N is the number of points per frame
-        feature = feature.transpose(1,2) 
-        NEW_N = feature.shape[1]
-        points_feature = feature.reshape(B,L*NEW_N,-1)
-
-        delta_motion = self.Transformer(box_seq_corners,points_feature,input_dict["valid_mask"])  #B*4*4
-
-        updated_ref_boxs = delta_motion[:,:HL,:]
-        updated_aux_box =  delta_motion[:,-1,:]
+        # Confidently static samples keep the 1st stage box and skip the refinement below
+        valid_mask = input_dict["valid_mask"]
+        refine_index = None
+        if self.early_exit_threshold is not None and self.use_motion_cls and not self.training:
+            early_exit = F.softmax(motion_state_logits, dim=1)[:, 0] >= self.early_exit_threshold
+            output_dict['early_exit'] = early_exit
+            self.early_exit_ratio.update(early_exit.float())
+            refine_index = torch.nonzero(~early_exit).squeeze(1)
+
+        updated_ref_boxs = input_dict['ref_boxs']
+        updated_aux_box = aux_box
+        if refine_index is None or len(refine_index) > 0:
+            if refine_index is not None:
+                B = len(refine_index)
+                x, box_seq_corners, valid_mask = [t.index_select(0, refine_index)
+                                                  for t in (x, box_seq_corners, valid_mask)]
+                if frame_index is not None:
+                    frame_index = frame_index.index_select(0, refine_index)
+                if self.shared_trunk:
+                    second_layer_out = second_layer_out.index_select(0, refine_index)
+                    trunk_out = trunk_out.index_select(0, refine_index)
+
+            if self.shared_trunk:
+                feature = self.feature_pointnet.forward_head(self.split_frames(second_layer_out, L_in),
+                                                             self.split_frames(trunk_out, L_in))
+                if frame_index is not None:
+                    feature = feature.reshape(B, L_in, *feature.shape[1:]).transpose(1, 2).flatten(2)
+                    feature = self.split_frames(self.gather_frames(feature, frame_index, feature.shape[2] // L_in), L)
+            else:
+                if frame_index is not None:
+                    # the padded frames are computed again, see the note below
+                    x = self.gather_frames(x, frame_index, chunk_size)
+                # Note: this reshape interleaves channels and frames; kept as is because trained checkpoints rely on it
+                solo_x = x.reshape(B*L,-1,chunk_size) # Reshape into separate point clouds
+                feature = self.feature_pointnet(solo_x) #(B*num) * C * N Note: N is the number of points per frame
+            feature = feature.transpose(1,2) 
+            NEW_N = feature.shape[1]
+            points_feature = feature.reshape(B,L*NEW_N,-1)
+
+            delta_motion = self.Transformer(box_seq_corners,points_feature,valid_mask)  #B*4*4
+
+            if refine_index is None:
+                updated_ref_boxs = delta_motion[:,:HL,:]
+                updated_aux_box =  delta_motion[:,-1,:]
+            else:
+                updated_ref_boxs = updated_ref_boxs.index_copy(0, refine_index, delta_motion[:,:HL,:])
+                updated_aux_box = updated_aux_box.index_copy(0, refine_index, delta_motion[:,-1,:])
 
         
         output_dict["estimation_boxes"] = aux_box
@@ -161,6 +235,57 @@ class SEQTRACK3D(base_model.MotionBaseModelMF):
 
         return output_dict
 
+    @staticmethod
+    def padded_frame_index(frame_valid):
+        """
+        :param frame_valid: B*L bool, the history frames followed by the current frame
+        :return: keep: L bool, the frames valid for at least one sample
+                 frame_index: B*L, for each frame the index among the kept frames of the frame it is read from.
+                 A padded history frame is read from the oldest valid history frame of its sample,
+                 or from the current frame when there is no valid history.
+        """
+        B, L = frame_valid.shape
+        keep = frame_valid.any(dim=0)
+        num_valid = frame_valid[:, :-1].sum(dim=1)
+        oldest_valid = torch.where(num_valid > 0, num_valid - 1, torch.full_like(num_valid, L - 1))
+        frames = torch.arange(L, device=frame_valid.device).expand(B, L)
+        frame_src = torch.where(frame_valid, frames, oldest_valid[:, None])
+        frame_index = (torch.cumsum(keep.long(), dim=0) - 1)[frame_src]
+        return keep, frame_index
+
+    @staticmethod
+    def gather_frames(x, frame_index, chunk_size):
+        """
+        (B,C,L'*N) -> (B,C,L*N), frame l of sample b is frame frame_index[b,l] of x
+        """
+        B, C, _ = x.shape
+        L = frame_index.shape[1]
+        x = x.reshape(B, C, -1, chunk_size)
+        index = frame_index[:, None, :, None].expand(B, C, L, chunk_size)
+        return torch.gather(x, 2, index).reshape(B, C, L * chunk_size)
+
+    @staticmethod
+    def split_frames(x, L):
+        """
+        (B,C,L*N) -> (B*L,C,N), one point cloud per frame
+        """
+        B, C, N = x.shape
+        return x.reshape(B, C, L, N // L).transpose(1, 2).reshape(B * L, C, N // L)
+
+    def on_load_checkpoint(self, checkpoint):
+        """
+        Convert checkpoints trained without the shared trunk: the trunk takes the per-point MLP of seg_pointnet,
+        and the per-point MLP of feature_pointnet is dropped. The feature head should be fine-tuned afterwards.
+        """
+        state_dict = checkpoint['state_dict']
+        if not self.shared_trunk or any(k.startswith('point_trunk.') for k in state_dict):
+            return
+        for key in list(state_dict.keys()):
+            if key.startswith('seg_pointnet.seq_per_point.'):
+                state_dict[key.replace('seg_pointnet.', 'point_trunk.', 1)] = state_dict.pop(key)
+            elif key.startswith('feature_pointnet.seq_per_point.'):
+                state_dict.pop(key)
+
     def compute_loss(self, data, output):
         loss_total = 0.0
         loss_dict = {}
@@ -186,7 +311,7 @@ class SEQTRACK3D(base_model.MotionBaseModelMF):
             ref_center_label = ref_label[:, :, :3] #B*hist_num*3
             ref_angle_label = torch.sin(ref_label[:,:,3]) 
 
-        loss_seg = F.cross_entropy(seg_logits, seg_label, weight=torch.tensor([0.5, 2.0]).cuda())
+        loss_seg = F.cross_entropy(seg_logits, seg_label, weight=torch.tensor([0.5, 2.0], device=seg_logits.device))
         if self.use_motion_cls:
             motion_cls = output['motion_cls']  # B,2
             loss_motion_cls = F.cross_entropy(motion_cls, motion_state_label)
@@ -286,3 +411,17 @@ class SEQTRACK3D(base_model.MotionBaseModelMF):
                                            global_step=self.global_step)
 
         return loss
+
+    def log_early_exit_ratio(self, stage):
+        if self.early_exit_threshold is None or self.early_exit_ratio.weight == 0:
+            return
+        self.log(f'early_exit_ratio/{stage}', self.early_exit_ratio.compute())
+        self.early_exit_ratio.reset()
+
+    def on_validation_epoch_end(self):
+        super().on_validation_epoch_end()
+        self.log_early_exit_ratio('test')
+
+    def on_test_epoch_end(self):
+        super().on_test_epoch_end()
+        self.log_early_exit_ratio('test')
@@ -0,0 +1,51 @@
+"""
+score_results.py
+Recompute the tracking metrics from the results saved by `python main.py --test --save_results ...`
+
+python score_results.py output/<run>/lightning_logs/version_0/tracking_results --IoU_space 3 --up_axis 0 0 1
+"""
+import argparse
+
+import numpy as np
+import torch
+
+from utils.metrics import TorchStreamingSuccess, TorchStreamingPrecision
+from utils.metrics import quaternionsToRotations, estimateOverlapArrays, estimateAccuracyArrays
+from utils.tracking_results import load_tracking_results
+
+
+def score(results, IoU_space=3, up_axis=(0, 0, 1)):
+    """
+    :return: dict of success, precision, number of frames and tracklets
+    """
+    gt = (results['gt_center'], results['gt_wlh'], quaternionsToRotations(results['gt_orientation']))
+    pred = (results['pred_center'], results['pred_wlh'], quaternionsToRotations(results['pred_orientation']))
+    ious = estimateOverlapArrays(gt, pred, dim=IoU_space, up_axis=up_axis)
+    distances = estimateAccuracyArrays(gt[0], pred[0], dim=IoU_space, up_axis=up_axis)
+
+    success, precision = TorchStreamingSuccess(), TorchStreamingPrecision()
+    success(torch.tensor(ious, dtype=torch.float32))
+    precision(torch.tensor(distances, dtype=torch.float32))
+    return {'success': float(success.compute()), 'precision': float(precision.compute()),
+            'frames': len(ious), 'tracklets': len(np.unique(results['tracklet_id']))}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', type=str, nargs='+', help='npz files or directories of npz files')
+    parser.add_argument('--IoU_space', type=int, default=3)
+    parser.add_argument('--up_axis', type=int, nargs=3, default=[0, 0, 1])
+    args = parser.parse_args()
+
+    results = load_tracking_results(args.paths)
+    print('| checkpoint | tracklets | frames | success | precision |')
+    print('|---|---|---|---|---|')
+    for checkpoint in np.unique(results['checkpoint_hash']):
+        selected = results['checkpoint_hash'] == checkpoint
+        metrics = score({k: v[selected] for k, v in results.items()}, args.IoU_space, tuple(args.up_axis))
+        print(f"| {checkpoint} | {metrics['tracklets']} | {metrics['frames']} | "
+              f"{metrics['success']:.2f} | {metrics['precision']:.2f} |")
+
+
+if __name__ == '__main__':
+    main()
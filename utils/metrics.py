@@ -72,6 +72,178 @@ def estimateOverlap(box_a, box_b, dim=2, up_axis=(0, -1, 0)):
         return 0.0
 
 
+def boxesToArrays(boxes):
+    """
+    :param boxes: list of N boxes
+    :return: centers <np.float: N, 3>, wlh <np.float: N, 3>, rotation matrices <np.float: N, 3, 3>
+    """
+    centers = np.stack([box.center for box in boxes], axis=0).astype(np.float64)
+    wlh = np.stack([box.wlh for box in boxes], axis=0).astype(np.float64)
+    rotations = np.stack([box.rotation_matrix for box in boxes], axis=0)
+    return centers, wlh, rotations
+
+
+def quaternionsToRotations(quaternions):
+    """
+    :param quaternions: <np.float: N, 4>, (w, x, y, z), normalised here like pyquaternion does
+    :return: <np.float: N, 3, 3>
+    """
+    w, x, y, z = (quaternions / np.linalg.norm(quaternions, axis=1, keepdims=True)).T
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)], axis=1),
+        np.stack([2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)], axis=1),
+        np.stack([2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)], axis=1),
+    ], axis=1)
+
+
+def cornersFromArrays(centers, wlh, rotations):
+    """
+    Batched Box.corners
+    :return: <np.float: N, 3, 8>
+    """
+    signs = np.array([[1, 1, 1, 1, -1, -1, -1, -1],
+                      [1, -1, -1, 1, 1, -1, -1, 1],
+                      [1, 1, -1, -1, 1, 1, -1, -1]])
+    corners = wlh[:, [1, 0, 2], None] / 2 * signs  # x along l, y along w, z along h
+    return np.einsum('nij,njk->nik', rotations, corners) + centers[:, :, None]
+
+
+def fromArraysToPolys(centers, wlh, rotations, up_axis=(0, -1, 0)):
+    """
+    Batched fromBoxToPoly
+    :return: <np.float: N, 4, 2>, the vertices of the BEV polygons
+    """
+    corners = cornersFromArrays(centers, wlh, rotations)
+    if up_axis[1] != 0:
+        return corners[:, [0, 2]][:, :, [0, 1, 5, 4]].transpose(0, 2, 1)
+    elif up_axis[2] != 0:
+        return corners[:, :2][:, :, [2, 3, 7, 6]].transpose(0, 2, 1)
+    raise ValueError("the up axis must be y or z")
+
+
+def _cross2d(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def polygonArea(polys):
+    """
+    :param polys: <np.float: N, V, 2>, ordered vertices
+    :return: <np.float: N>, shoelace area
+    """
+    return np.abs(np.sum(_cross2d(polys, np.roll(polys, -1, axis=1)), axis=1)) / 2
+
+
+def _pointsInConvexPolys(points, polys, eps=1e-9):
+    """
+    :param points: N,P,2
+    :param polys: N,V,2, convex, either orientation
+    :return: N,P bool, True for the points inside or on the border of the polygon
+    """
+    edges = np.roll(polys, -1, axis=1) - polys  # N,V,2
+    rel = points[:, :, None, :] - polys[:, None, :, :]  # N,P,V,2
+    side = _cross2d(edges[:, None], rel)  # N,P,V
+    return np.all(side >= -eps, axis=2) | np.all(side <= eps, axis=2)
+
+
+def convexPolygonIntersectionArea(polys_a, polys_b, eps=1e-9):
+    """
+    Intersection area of pairs of convex polygons.
+    The intersection is the convex hull of the vertices of each polygon lying in the other one and of the
+    crossings of their edges, its vertices are ordered by angle around their centroid.
+    :param polys_a: <np.float: N, V, 2>
+    :param polys_b: <np.float: N, V, 2>
+    :return: <np.float: N>
+    """
+    a_start, b_start = polys_a[:, :, None, :], polys_b[:, None, :, :]
+    a_edge = (np.roll(polys_a, -1, axis=1) - polys_a)[:, :, None, :]  # N,V,1,2
+    b_edge = (np.roll(polys_b, -1, axis=1) - polys_b)[:, None, :, :]  # N,1,V,2
+    denom = _cross2d(a_edge, b_edge)  # N,V,V
+    parallel = np.abs(denom) < eps
+    denom = np.where(parallel, 1.0, denom)
+    t = _cross2d(b_start - a_start, b_edge) / denom
+    u = _cross2d(b_start - a_start, a_edge) / denom
+    crossing_valid = ~parallel & (t >= -eps) & (t <= 1 + eps) & (u >= -eps) & (u <= 1 + eps)
+    crossings = a_start + t[..., None] * a_edge  # N,V,V,2
+
+    N = polys_a.shape[0]
+    points = np.concatenate([polys_a, polys_b, crossings.reshape(N, -1, 2)], axis=1)
+    valid = np.concatenate([_pointsInConvexPolys(polys_a, polys_b, eps),
+                            _pointsInConvexPolys(polys_b, polys_a, eps),
+                            crossing_valid.reshape(N, -1)], axis=1)
+
+    num_valid = valid.sum(axis=1)
+    centroid = np.sum(points * valid[..., None], axis=1) / np.maximum(num_valid, 1)[:, None]
+    angles = np.arctan2(points[..., 1] - centroid[:, None, 1], points[..., 0] - centroid[:, None, 0])
+    angles = np.where(valid, angles, np.inf)
+    order = np.argsort(angles, axis=1)
+    points = np.take_along_axis(points, order[..., None], axis=1)
+    valid = np.take_along_axis(valid, order, axis=1)
+    # Invalid points are sorted last, collapse them onto the first vertex so that they add no area
+    points = np.where(valid[..., None], points, points[:, :1])
+    return np.where(num_valid >= 3, polygonArea(points), 0.0)
+
+
+def estimateOverlapArrays(boxes_a, boxes_b, dim=2, up_axis=(0, -1, 0)):
+    """
+    estimateOverlap for N pairs of boxes at once
+    :param boxes_a: (centers, wlh, rotations) of N boxes, see boxesToArrays
+    :param boxes_b: (centers, wlh, rotations) of N boxes
+    :return: <np.float: N>
+    """
+    centers_a, wlh_a, _ = boxes_a
+    centers_b, wlh_b, _ = boxes_b
+    if len(centers_a) == 0:
+        return np.zeros(0)
+    polys_a = fromArraysToPolys(*boxes_a, up_axis=up_axis)
+    polys_b = fromArraysToPolys(*boxes_b, up_axis=up_axis)
+    inter_area = convexPolygonIntersectionArea(polys_a, polys_b)
+    if dim == 2:
+        union_area = polygonArea(polys_a) + polygonArea(polys_b) - inter_area
+        return np.where(union_area > 0, inter_area / np.where(union_area > 0, union_area, 1.0), 0.0)
+
+    up_axis = np.array(up_axis)
+    up_a = centers_a[:, up_axis != 0][:, 0]
+    up_b = centers_b[:, up_axis != 0][:, 0]
+    up_max = np.minimum(up_a, up_b)
+    up_min = np.maximum(up_a - wlh_a[:, 2], up_b - wlh_b[:, 2])
+    inter_vol = inter_area * np.maximum(0, up_max - up_min)
+    union_vol = np.prod(wlh_a, axis=1) + np.prod(wlh_b, axis=1) - inter_vol
+    return np.where(union_vol > 0, inter_vol / np.where(union_vol > 0, union_vol, 1.0), 0.0)
+
+
+def estimateAccuracyArrays(centers_a, centers_b, dim=3, up_axis=(0, -1, 0)):
+    """
+    estimateAccuracy for N pairs of box centers at once
+    :return: <np.float: N>
+    """
+    if dim == 2:
+        up_axis = np.array(up_axis)
+        centers_a, centers_b = centers_a[:, up_axis != 0], centers_b[:, up_axis != 0]
+    return np.linalg.norm(centers_a - centers_b, ord=2, axis=1)
+
+
+def estimateOverlapBatch(boxes_a, boxes_b, dim=2, up_axis=(0, -1, 0)):
+    """
+    estimateOverlap for two lists of N boxes
+    :return: <np.float: N>
+    """
+    if len(boxes_a) == 0:
+        return np.zeros(0)
+    return estimateOverlapArrays(boxesToArrays(boxes_a), boxesToArrays(boxes_b), dim=dim, up_axis=up_axis)
+
+
+def estimateAccuracyBatch(boxes_a, boxes_b, dim=3, up_axis=(0, -1, 0)):
+    """
+    estimateAccuracy for two lists of N boxes
+    :return: <np.float: N>
+    """
+    if len(boxes_a) == 0:
+        return np.zeros(0)
+    centers_a = np.stack([box.center for box in boxes_a])
+    centers_b = np.stack([box.center for box in boxes_b])
+    return estimateAccuracyArrays(centers_a, centers_b, dim=dim, up_axis=up_axis)
+
+
 class TorchPrecision(Metric):
     """Computes and stores the Precision using torchMetrics"""
 
@@ -123,6 +295,58 @@ class TorchSuccess(Metric):
     def update(self, val):
         self.overlaps.append(val)
 
+class TorchStreamingPrecision(Metric):
+    """TorchPrecision with a fixed-size state: the histogram of the distances between the thresholds"""
+
+    def __init__(self, n=21, max_accuracy=2, dist_sync_on_step=False):
+        super().__init__(dist_sync_on_step=dist_sync_on_step)
+        self.max_accuracy = max_accuracy
+        self.register_buffer("Xaxis", torch.linspace(0, self.max_accuracy, steps=n), persistent=False)
+        # bins[k]: distances in (Xaxis[k-1], Xaxis[k]], bins[n]: distances above the last threshold
+        self.add_state("bins", default=torch.zeros(n + 1, dtype=torch.long), dist_reduce_fx='sum')
+
+    def update(self, val):
+        # one searchsorted and bincount per batch, the values are compared in their dtype
+        Xaxis = self.Xaxis
+        val = val.reshape(-1) if val.device == Xaxis.device else val.reshape(-1).to(Xaxis.device)
+        if val.dtype != Xaxis.dtype:
+            Xaxis = Xaxis.to(val.dtype)
+        self.bins.add_(torch.bincount(torch.searchsorted(Xaxis, val), minlength=self.bins.numel()))
+
+    def compute(self):
+        total = self.bins.sum()
+        if total == 0:
+            return 0
+        # distances below each threshold
+        counts = torch.cumsum(self.bins[:-1], dim=0)
+        return torch.trapz(counts / total, x=self.Xaxis) * 100 / self.max_accuracy
+
+class TorchStreamingSuccess(Metric):
+    """TorchSuccess with a fixed-size state: the histogram of the overlaps between the thresholds"""
+
+    def __init__(self, n=21, max_overlap=1, dist_sync_on_step=False):
+        super().__init__(dist_sync_on_step=dist_sync_on_step)
+        self.max_overlap = max_overlap
+        self.register_buffer("Xaxis", torch.linspace(0, self.max_overlap, steps=n), persistent=False)
+        # bins[k]: overlaps in [Xaxis[k-1], Xaxis[k]), bins[0]: overlaps below the first threshold
+        self.add_state("bins", default=torch.zeros(n + 1, dtype=torch.long), dist_reduce_fx='sum')
+
+    def update(self, val):
+        # one searchsorted and bincount per batch, the values are compared in their dtype
+        Xaxis = self.Xaxis
+        val = val.reshape(-1) if val.device == Xaxis.device else val.reshape(-1).to(Xaxis.device)
+        if val.dtype != Xaxis.dtype:
+            Xaxis = Xaxis.to(val.dtype)
+        self.bins.add_(torch.bincount(torch.searchsorted(Xaxis, val, right=True), minlength=self.bins.numel()))
+
+    def compute(self):
+        total = self.bins.sum()
+        if total == 0:
+            return 0
+        # overlaps above each threshold
+        counts = total - torch.cumsum(self.bins[:-1], dim=0)
+        return torch.trapz(counts / total, x=self.Xaxis) * 100 / self.max_overlap
+
 class TorchRuntime(Metric):
 
     def __init__(self):
@@ -150,4 +374,69 @@ class TorchNumFrames(Metric):
         self.n_frames += n_frames
 
     def compute(self):
-        return self.n_frames
\ No newline at end of file
+        return self.n_frames
+
+class TorchDataStats(Metric):
+    """Mean of the 'data_stats' vectors of the training samples"""
+
+    def __init__(self, n):
+        super().__init__()
+        self.add_state("sums", default=torch.zeros(n, dtype=torch.long), dist_reduce_fx='sum')
+        self.add_state("num_samples", default=torch.tensor(0, dtype=torch.long), dist_reduce_fx='sum')
+
+    def update(self, stats):
+        self.sums += stats.sum(dim=0)
+        self.num_samples += stats.shape[0]
+
+    def compute(self):
+        return self.sums.double() / self.num_samples
+
+class TorchLatency(Metric):
+    """
+    Percentiles of the per-frame latencies <N, S> of S stages, and of their total without the last stage, read
+    from fixed-size histograms of log-spaced bins (bins_per_decade=100 bins are 2.3% wide). A negative latency
+    marks a stage the frame did not run (StageTimer.skip): it is left out of the percentiles of the stage.
+    """
+
+    def __init__(self, num_stages, min_ns=1e2, max_ns=1e11, bins_per_decade=100):
+        super().__init__()
+        num_bins = int(round(np.log10(max_ns / min_ns) * bins_per_decade))
+        self.register_buffer("edges", torch.logspace(np.log10(min_ns), np.log10(max_ns), num_bins + 1,
+                                                     dtype=torch.double), persistent=False)
+        # counts[s, k]: latencies of stage s in [edges[k-1], edges[k]), the first and last bins count the latencies
+        # below min_ns and above max_ns
+        self.add_state("counts", default=torch.zeros(num_stages + 1, num_bins + 2, dtype=torch.long),
+                       dist_reduce_fx='sum')
+
+    def update(self, latencies):
+        num_stages, num_bins = self.counts.shape
+        latencies = latencies.reshape(-1, num_stages - 1).to(self.edges.device, torch.double)
+        latencies = torch.cat([latencies, latencies[:, :-1].clamp(min=0).sum(dim=1, keepdim=True)], dim=1)
+        bins = torch.searchsorted(self.edges, latencies, right=True)
+        bins += torch.arange(num_stages, device=bins.device) * num_bins
+        bins = bins[latencies >= 0]  # the stages the frames ran
+        self.counts.add_(torch.bincount(bins, minlength=self.counts.numel()).reshape(self.counts.shape))
+
+    def frames_per_stage(self):
+        """
+        :return: <S+1> the frames that ran each stage, summed over the ranks: every rank calls it
+        """
+        with self.sync_context():
+            return self.counts.sum(dim=1)
+
+    def compute(self, percentiles=(50, 95, 99)):
+        """
+        :return: <len(percentiles), S+1>, interpolated geometrically within the bins, nan for the stages without
+            latencies
+        """
+        counts = self.counts.double()
+        total = counts.sum(dim=1, keepdim=True)  # <S+1, 1>
+        q = torch.tensor(percentiles, dtype=torch.double, device=counts.device) / 100
+        cumulative = torch.cumsum(counts, dim=1)
+        targets = (q * total).clamp(min=1)
+        bins = torch.searchsorted(cumulative, targets).clamp(max=counts.shape[1] - 1)  # <S+1, P>
+        fraction = (targets - cumulative.gather(1, bins) + counts.gather(1, bins)) / counts.gather(1, bins)
+        low = torch.cat([self.edges[:1], self.edges])[bins]
+        high = torch.cat([self.edges, self.edges[-1:]])[bins]
+        quantiles = (low * (high / low) ** fraction).T
+        return torch.where(total.T > 0, quantiles, torch.full_like(quantiles, float('nan')))
@@ -0,0 +1,55 @@
+"""
+timing.py
+Cumulative wall-clock timers of named stages
+"""
+import time
+
+import numpy as np
+
+
+class StageTimer(object):
+    """
+    Accumulates the nanoseconds spent in each stage of a sequence of stages:
+
+        timer.start()
+        ...  # read
+        timer.lap('read')
+        ...  # crop
+        timer.lap('crop')
+
+    A disabled timer only costs the method calls.
+    """
+
+    def __init__(self, stages, enabled=True):
+        self.stages = tuple(stages)
+        self.index = {name: i for i, name in enumerate(self.stages)}
+        self.enabled = enabled
+        self.ns = np.zeros(len(self.stages), dtype=np.int64)
+        self.last = None
+
+    def start(self):
+        if self.enabled:
+            self.last = time.perf_counter_ns()
+
+    def lap(self, name):
+        """
+        Adds the time since the last start() or lap() to the stage `name`
+        """
+        if self.enabled:
+            now = time.perf_counter_ns()
+            self.ns[self.index[name]] += now - self.last
+            self.last = now
+
+    def skip(self, *names):
+        """
+        Marks the stages `names` as not run since the last reset(), with -1 nanoseconds
+        """
+        if self.enabled:
+            self.ns[[self.index[name] for name in names]] = -1
+
+    def reset(self):
+        self.ns[:] = 0
+        self.last = None
+
+
+NULL_TIMER = StageTimer((), enabled=False)
@@ -0,0 +1,80 @@
+"""
+tracking_results.py
+Per-frame predicted and ground-truth boxes of test runs, saved as npz columns for offline re-scoring
+"""
+import glob
+import hashlib
+import os
+
+import numpy as np
+
+BOX_COLUMNS = ('center', 'wlh', 'orientation')
+
+
+def checkpoint_hash(checkpoint, length=12):
+    """
+    :param checkpoint: checkpoint path, None for an untrained model
+    :return: short sha256 of the checkpoint file
+    """
+    if checkpoint is None:
+        return 'untrained'
+    sha = hashlib.sha256()
+    with open(checkpoint, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()[:length]
+
+
+def boxes_to_columns(boxes):
+    """
+    :return: dict of center <N,3>, wlh <N,3> and orientation quaternions (w, x, y, z) <N,4>
+    """
+    return {
+        'center': np.stack([box.center for box in boxes]).astype(np.float64),
+        'wlh': np.stack([box.wlh for box in boxes]).astype(np.float64),
+        'orientation': np.stack([box.orientation.elements for box in boxes]).astype(np.float64),
+    }
+
+
+def save_tracking_results(file_name, tracklets, checkpoint=None):
+    """
+    :param tracklets: list of (tracklet_id, gt boxes, predicted boxes), one box per frame
+    :param checkpoint: checkpoint path, stored as its hash
+    """
+    tracklet_ids = np.concatenate([np.full(len(gt_bbs), tracklet_id, dtype=np.int32)
+                                   for tracklet_id, gt_bbs, _ in tracklets])
+    frame_ids = np.concatenate([np.arange(len(gt_bbs), dtype=np.int32) for _, gt_bbs, _ in tracklets])
+    gt = boxes_to_columns([bb for _, gt_bbs, _ in tracklets for bb in gt_bbs])
+    pred = boxes_to_columns([bb for _, _, pred_bbs in tracklets for bb in pred_bbs])
+
+    os.makedirs(os.path.dirname(file_name) or '.', exist_ok=True)
+    np.savez_compressed(file_name,
+                        checkpoint_hash=np.array(checkpoint_hash(checkpoint)),
+                        tracklet_id=tracklet_ids, frame_id=frame_ids,
+                        **{f'gt_{k}': v for k, v in gt.items()},
+                        **{f'pred_{k}': v for k, v in pred.items()})
+
+
+def load_tracking_results(paths):
+    """
+    :param paths: npz files or directories of npz files, e.g. the shards written by each rank
+    :return: dict of columns, with one row per (checkpoint_hash, tracklet_id, frame_id).
+             Frames duplicated across shards (e.g. by distributed padding) are kept once.
+    """
+    files = []
+    for path in paths:
+        files += sorted(glob.glob(os.path.join(path, '*.npz'))) if os.path.isdir(path) else [path]
+
+    shards = []
+    for file_name in files:
+        with np.load(file_name) as data:
+            shard = {k: data[k] for k in data.files}
+        shard['checkpoint_hash'] = np.full(len(shard['tracklet_id']), shard['checkpoint_hash'].item())
+        shards.append(shard)
+    if len(shards) == 0:
+        raise ValueError(f"no tracking results found in {paths}")
+    results = {k: np.concatenate([shard[k] for shard in shards]) for k in shards[0]}
+
+    keys = np.rec.fromarrays([results['checkpoint_hash'], results['tracklet_id'], results['frame_id']])
+    _, index = np.unique(keys, return_index=True)
+    return {k: v[index] for k, v in results.items()}
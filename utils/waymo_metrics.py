@@ -2,6 +2,7 @@ import numpy as np
 import torch
 import torchmetrics.utilities.data
 from shapely.geometry import Polygon
+from utils.metrics import estimateOverlapBatch
 
 def fromWaymoBoxToPoly(box):
     return Polygon(tuple(box.corners()[[0, 1]].T[[0, 1, 5, 4]]))
@@ -23,4 +24,11 @@ def estimateWaymoOverlap(box_a, box_b, dim=2):
         anno_vol = box_a.wlh[0] * box_a.wlh[1] * box_a.wlh[2]
         subm_vol = box_b.wlh[0] * box_b.wlh[1] * box_b.wlh[2]
         overlap = inter_vol * 1.0 / (anno_vol + subm_vol - inter_vol)
-    return overlap
\ No newline at end of file
+    return overlap
+
+def estimateWaymoOverlapBatch(boxes_a, boxes_b, dim=2):
+    """
+    estimateWaymoOverlap for N pairs of boxes at once, the polygons are the z-up footprints
+    :return: <np.float: N>
+    """
+    return estimateOverlapBatch(boxes_a, boxes_b, dim=dim, up_axis=(0, 0, 1))